@@ -0,0 +1,249 @@
+﻿import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Generic, Type, TypeVar, Protocol
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable
+from pydantic import BaseModel
+
+log = logging.getLogger('llm_cache')
+
+TOutput = TypeVar('TOutput', bound=BaseModel)
+
+
+class ResponseCache(Protocol):
+    """A store for serialized responses, keyed by a string."""
+
+    def get(self, key: str) -> str | None: ...
+
+    def set(self, key: str, value: str) -> None: ...
+
+
+def response_cache_key(schema: Type[BaseModel], prompt: Any, namespace: str = '') -> str:
+    """A stable key for a (schema, prompt) combination."""
+    payload = {
+        'namespace': namespace,
+        'schema': schema.__name__,
+        'prompt': _serialize_prompt(prompt)
+    }
+
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class InMemoryResponseCache:
+    """
+    A bounded, least-recently-used store for serialized LLM responses.
+    """
+
+    def __init__(self, max_size: int = 512) -> None:
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._max_size = max_size
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+
+# Shared by every cached model in the process, so repeated trips can reuse previous answers.
+default_cache = InMemoryResponseCache()
+
+
+class DiskResponseCache:
+    """
+    A persistent store for serialized LLM responses that survives between runs. Each entry is a small JSON file
+    that expires after `ttl_seconds`.
+    """
+
+    def __init__(self, directory: Path, ttl_seconds: float) -> None:
+        self._directory = directory
+        self._ttl_seconds = ttl_seconds
+
+    def _path(self, key: str) -> Path:
+        return self._directory / f'{hashlib.sha256(key.encode("utf-8")).hexdigest()}.json'
+
+    def get(self, key: str) -> str | None:
+        path = self._path(key)
+
+        try:
+            entry = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+
+        if entry.get('expires_at', 0) < time.time():
+            path.unlink(missing_ok=True)
+            return None
+
+        return entry.get('value')
+
+    def set(self, key: str, value: str) -> None:
+        try:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            self._path(key).write_text(
+                json.dumps({'expires_at': time.time() + self._ttl_seconds, 'value': value}),
+                encoding='utf-8')
+        except OSError as e:
+            log.warning(f'Could not write to the response cache at {self._directory}: {e}')
+
+
+def _serialize_prompt(prompt: Any) -> Any:
+    """Convert a prompt (string, message or list of messages) into something JSON serializable."""
+    if isinstance(prompt, str):
+        return prompt
+    if isinstance(prompt, BaseMessage):
+        return {'type': prompt.type, 'content': prompt.content}
+    if isinstance(prompt, (list, tuple)):
+        return [_serialize_prompt(x) for x in prompt]
+    return str(prompt)
+
+
+class CachedStructuredOutput(Generic[TOutput]):
+    """
+    A structured-output runnable that looks up a response cache before calling the underlying model.
+    """
+
+    def __init__(
+            self,
+            runnable: Runnable,
+            schema: Type[TOutput],
+            model_name: str,
+            cache: InMemoryResponseCache,
+            refresh: bool
+    ) -> None:
+        self._runnable = runnable
+        self._schema = schema
+        self._model_name = model_name
+        self._schema_json = json.dumps(schema.model_json_schema(), sort_keys=True)
+        self._cache = cache
+        self._refresh = refresh
+
+    def _key(self, prompt: Any) -> str:
+        payload = {
+            'model': self._model_name,
+            'schema': self._schema_json,
+            'prompt': _serialize_prompt(prompt)
+        }
+
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _lookup(self, prompt: Any) -> tuple[str, TOutput | None]:
+        """Returns the cache key and the cached response, if any."""
+        key = self._key(prompt)
+
+        if not self._refresh:
+            cached = self._cache.get(key)
+            if cached is not None:
+                log.info(f'⚡ Cache hit for {self._schema.__name__}')
+                return key, self._schema.model_validate_json(cached)
+
+        return key, None
+
+    def _store(self, key: str, response: Any) -> None:
+        if isinstance(response, self._schema):
+            self._cache.set(key, response.model_dump_json())
+
+    def invoke(self, input: Any, config: Any = None, **kwargs: Any) -> Any:
+        key, cached = self._lookup(input)
+        if cached is not None:
+            return cached
+
+        response = self._runnable.invoke(input, config, **kwargs)
+        self._store(key, response)
+
+        return response
+
+    async def ainvoke(self, input: Any, config: Any = None, **kwargs: Any) -> Any:
+        key, cached = self._lookup(input)
+        if cached is not None:
+            return cached
+
+        response = await self._runnable.ainvoke(input, config, **kwargs)
+        self._store(key, response)
+
+        return response
+
+    def batch(self, inputs: list[Any], config: Any = None, **kwargs: Any) -> list[Any]:
+        """Like `invoke`, for many prompts at once. Only the prompts missing from the cache are sent to the model."""
+        lookups = [self._lookup(prompt) for prompt in inputs]
+        missing = [i for i, (_, cached) in enumerate(lookups) if cached is None]
+
+        responses: list[Any] = [cached for _, cached in lookups]
+
+        if missing:
+            fresh = self._runnable.batch([inputs[i] for i in missing], config, **kwargs)
+
+            for i, response in zip(missing, fresh):
+                key, _ = lookups[i]
+                self._store(key, response)
+                responses[i] = response
+
+        return responses
+
+    async def abatch(self, inputs: list[Any], config: Any = None, **kwargs: Any) -> list[Any]:
+        lookups = [self._lookup(prompt) for prompt in inputs]
+        missing = [i for i, (_, cached) in enumerate(lookups) if cached is None]
+
+        responses: list[Any] = [cached for _, cached in lookups]
+
+        if missing:
+            fresh = await self._runnable.abatch([inputs[i] for i in missing], config, **kwargs)
+
+            for i, response in zip(missing, fresh):
+                key, _ = lookups[i]
+                self._store(key, response)
+                responses[i] = response
+
+        return responses
+
+
+class CachedChatModel:
+    """
+    Wraps a chat model so that structured-output calls with an identical (model, schema, prompt) combination are
+    served from a cache instead of the remote API. Every other attribute is delegated to the wrapped model.
+    """
+
+    def __init__(
+            self,
+            llm: BaseChatModel,
+            cache: InMemoryResponseCache | None = None
+    ) -> None:
+        self._llm = llm
+        self._cache = cache if cache is not None else default_cache
+        self._model_name = str(getattr(llm, 'model_name', None) or getattr(llm, 'model', None) or type(llm).__name__)
+
+    def with_structured_output(
+            self,
+            schema: Type[TOutput],
+            refresh: bool = False,
+            **kwargs: Any
+    ) -> CachedStructuredOutput[TOutput]:
+        """
+        :param schema: The Pydantic model the response should conform to
+        :param refresh: Skip the cache lookup and always call the model (the new response is still stored)
+        """
+        return CachedStructuredOutput(
+            runnable=self._llm.with_structured_output(schema=schema, **kwargs),
+            schema=schema,
+            model_name=self._model_name,
+            cache=self._cache,
+            refresh=refresh
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._llm, name)
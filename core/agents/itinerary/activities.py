@@ -4,6 +4,11 @@ from core.agents.itinerary.places import estimate_place_cost
 from core.models.itinerary import ItineraryActivity, ActivityType
 from core.models.places import Place, Establishment, Event, BookingType
 
+_ACTIVITY_TYPE_BY_CLASS: dict[type, ActivityType] = {
+    Establishment: ActivityType.DINING,
+    Event: ActivityType.EVENT,
+}
+
 
 class ItineraryActivityFactory:
     @staticmethod
@@ -16,13 +21,8 @@ class ItineraryActivityFactory:
 
         end_time = start_time + timedelta(hours=duration_hours)
 
-        # Determine the activity type
-        if isinstance(place, Establishment):
-            activity_type = ActivityType.DINING
-        elif isinstance(place, Event):
-            activity_type = ActivityType.EVENT
-        else:
-            activity_type = ActivityType.SIGHTSEEING
+        # Determine the activity type, anything that isn't dining or an event is sightseeing
+        activity_type = _ACTIVITY_TYPE_BY_CLASS.get(type(place), ActivityType.SIGHTSEEING)
 
         description = place.reason_to_go
 
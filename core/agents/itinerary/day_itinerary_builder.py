@@ -1,19 +1,23 @@
-﻿import logging
+﻿import json
+import logging
 import uuid
+from collections import defaultdict
 from datetime import timedelta, datetime, time, date
-from typing import TypeVar, cast, List, Iterable, Callable
+from pathlib import Path
+from typing import TypeVar, cast, List, Iterable, Callable, Any
 
 from langchain_core.language_models import BaseChatModel
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import SystemMessage, HumanMessage, BaseMessage
 from pydantic import BaseModel, Field
 
+from core.agents.cache import CachedChatModel, DiskResponseCache, CachedStructuredOutput
 from core.agents.itinerary.activities import ItineraryActivityFactory
 from core.agents.itinerary.themes import DailyThemes
 from core.models.itinerary import DayItinerary, ActivityType, ItineraryActivity, TransportMode, TravelSegment
 from core.models.places import Place, Establishment, Landmark, Event
 from core.models.trip import TripRequest
 from core.tools.spherical_distance import haversine_distance
-from core.utils import items_of_type
+from core.utils import bucket_by_type
 
 
 class TravelSegmentOptions(BaseModel):
@@ -23,6 +27,37 @@ class TravelSegmentOptions(BaseModel):
 
 T = TypeVar('T')
 
+# Transport fares barely change, so they are kept between runs
+fare_cache = DiskResponseCache(Path.home() / '.travelplanner' / 'fares', ttl_seconds=30 * 24 * 60 * 60)
+
+# Upper bound on day prompts sent to the LLM at the same time, to stay clear of provider rate limits on long trips
+MAX_CONCURRENT_DAYS = 5
+
+
+
+def _place_for_day_prompt(place: Place) -> dict[str, Any]:
+    """
+    The fields of a place that the LLM needs to fit it into a day. Descriptions, opening hours, websites and the like
+    are left out, since every place is offered to the LLM on many days and they would only cost input tokens.
+    """
+    projected: dict[str, Any] = {
+        'id': str(place.id),
+        'name': place.name,
+        'priority': place.priority.name,
+        'typical_hours_of_stay': place.typical_hours_of_stay
+    }
+
+    if isinstance(place, Establishment):
+        projected['type'] = place.establishment_type
+        projected['average_price'] = place.average_price
+    if isinstance(place, Event):
+        projected['date_and_time'] = place.date_and_time.isoformat()
+        projected['price_options'] = place.price_options
+    if place.coordinates is not None:
+        projected['coordinates'] = f'{place.coordinates.latitude:.4f},{place.coordinates.longitude:.4f}'
+
+    return projected
+
 
 class ActivitySchedule(BaseModel):
     place_id: uuid.UUID = Field(
@@ -43,9 +78,24 @@ class DailyActivities(BaseModel):
 
 
 class ScheduleBuilder:
-    def __init__(self, llm: BaseChatModel):
+    def __init__(
+            self,
+            llm: BaseChatModel | CachedChatModel,
+            refresh_activities: bool = False,
+            llm_fast: BaseChatModel | CachedChatModel | None = None
+    ):
+        """
+        :param llm: The model used for scheduling. Plain models are wrapped with a response cache.
+        :param refresh_activities: Always request new day activities instead of reusing cached ones (used when
+        re-planning, otherwise the same over-budget schedule would be returned again)
+        :param llm_fast: Optional cheaper model for looking up transport fares. Defaults to `llm`.
+        """
         self._log = logging.getLogger(name='day_itinerary_builder')
-        self._llm = llm
+        self._llm = llm if isinstance(llm, CachedChatModel) else CachedChatModel(llm)
+        self._llm_fast = self._llm if llm_fast is None else (
+            llm_fast if isinstance(llm_fast, CachedChatModel) else CachedChatModel(llm_fast))
+        self._refresh_activities = refresh_activities
+        self._place_dumps: dict[uuid.UUID, dict[str, Any]] = {}
 
     def build(self, trip_request: TripRequest, places: list[Place], themes: DailyThemes) -> list[DayItinerary]:
         """
@@ -54,81 +104,142 @@ class ScheduleBuilder:
         :param places: The selected places to build the schedule around
         :param themes: The themes for each day
         """
+        options = self._get_travel_segment_options(trip_request.destination)
+        prompts, day_dates = self._prepare_days(trip_request, places, themes)
+
+        responses = self._day_activities_llm().batch(prompts, config={'max_concurrency': MAX_CONCURRENT_DAYS})
+
+        return self._assemble_days(places, themes, day_dates, responses, options)
+
+    async def abuild(self, trip_request: TripRequest, places: list[Place], themes: DailyThemes) -> list[DayItinerary]:
+        """
+        Same as `build`, but all LLM calls are awaited, so the days are requested concurrently without blocking the
+        event loop.
+        """
+        options = await self._aget_travel_segment_options(trip_request.destination)
+        prompts, day_dates = self._prepare_days(trip_request, places, themes)
 
+        responses = await self._day_activities_llm().abatch(
+            prompts, config={'max_concurrency': MAX_CONCURRENT_DAYS})
+
+        return self._assemble_days(places, themes, day_dates, responses, options)
+
+    def _day_activities_llm(self) -> CachedStructuredOutput[DailyActivities]:
+        return self._llm.with_structured_output(schema=DailyActivities, refresh=self._refresh_activities)
+
+    def _prepare_days(
+            self,
+            trip_request: TripRequest,
+            places: list[Place],
+            themes: DailyThemes
+    ) -> tuple[list[list[BaseMessage]], list[date]]:
+        """Creates the prompt and the date for each day of the trip."""
         self._log.info('📅 Building itineraries for each day')
         self._log.info(f'{len(places)} Available places: {[p.name for p in places]}')
         self._log.info(f'Available themes: {themes.list}')
 
-        daily_itineraries: list[DayItinerary] = []
-        current_date = trip_request.start_date
-        options = self._get_travel_segment_options()
+        places_by_type = bucket_by_type(places)
+        day_dates = [trip_request.start_date + timedelta(days=i) for i in range(len(themes.list))]
+        daily_pools = self._split_places_across_days(places_by_type, len(themes.list))
+
+        # Index the events by date once, instead of scanning all of them for every day
+        events_by_date: dict[date, list[Event]] = defaultdict(list)
+        for event in cast(list[Event], places_by_type.get(Event, [])):
+            events_by_date[event.date_and_time.date()].append(event)
+
+        # Every day gets its own pool up-front, so the days no longer depend on each other and can be requested at once
+        prompts = [
+            self._create_day_prompt(
+                trip_request=trip_request,
+                all_places_by_type=places_by_type,
+                available_places=pool,
+                events=events_by_date.get(day_date, []),
+                current_date=day_date,
+                theme=theme)
+            for pool, day_date, theme in zip(daily_pools, day_dates, themes.list)
+        ]
 
-        available_places = places.copy()
+        self._log.info(f'🤔 Requesting activities for {len(prompts)} days')
 
-        for day_num, theme in enumerate(themes.list, 1):
-            self._log.info(f'📅 Building itinerary for day {day_num} (theme: {theme})')
+        return prompts, day_dates
 
-            if len(available_places) < 12:
-                self._log.info('❗ Shortage on available places. Resetting state to include all places.')
-                available_places = places.copy()  # Make all places available again if we run out of places
+    def _assemble_days(
+            self,
+            places: list[Place],
+            themes: DailyThemes,
+            day_dates: list[date],
+            responses: list[Any],
+            options: TravelSegmentOptions
+    ) -> list[DayItinerary]:
+        places_by_id = {place.id: place for place in places}
+        daily_itineraries: list[DayItinerary] = []
 
-            activities = self._build_day_activities(
-                all_places=places,
-                available_places=available_places,
-                current_date=current_date,
-                theme=theme,
-                trip_request=trip_request)
+        for day_num, (theme, day_date, response) in enumerate(zip(themes.list, day_dates, responses), 1):
+            self._log.info(f'📅 Building itinerary for day {day_num} (theme: {theme})')
 
+            activities = self._to_activities(response, places_by_id, day_date)
             travel_segments = self.calculate_travel_segments(activities, options)
 
             total_activity_cost: float = sum(a.estimated_cost for a in activities)
             total_travel_cost: float = sum(t.total_cost for t in travel_segments)
 
-            day_itinerary = DayItinerary(
-                day_date=current_date,
+            daily_itineraries.append(DayItinerary(
+                day_date=day_date,
                 day_number=day_num,
                 theme=theme,
                 activities=activities,
                 travel_segments=travel_segments,
                 total_estimated_cost=total_activity_cost + total_travel_cost,
                 key_highlights=[a.name for a in activities if a.activity_type == ActivityType.SIGHTSEEING][:3]
-            )
-
-            daily_itineraries.append(day_itinerary)
-            current_date += timedelta(days=1)
-
-            # Exclude the places from the current day for next days
-            day_place_ids = {activity.place_id for activity in activities}
-            self._log.info(f'Removing {len(day_place_ids)} places from pool.')
-            before = len(available_places)
-            available_places = [p for p in places if p.id not in day_place_ids]
-            self._log.info(f'Removed {before - len(available_places)} places')
+            ))
 
         return daily_itineraries
 
-    def _build_day_activities(self,
-                              all_places: list[Place],
-                              available_places: list[Place],
-                              current_date: date,
-                              trip_request: TripRequest,
-                              theme: str
-                              ) -> list[ItineraryActivity]:
-        self._log.info(f'🤔 Building activities with {len(available_places)} available places')
-
-        # Separate places by type
-        landmarks = items_of_type(available_places, Landmark)
-        establishments = items_of_type(available_places, Establishment)
-        events = [x for x in items_of_type(available_places, Event) if x.date_and_time.date() == date]
-
-        self._extend_unique_until(landmarks, items_of_type(all_places, Landmark), 5, key=lambda x: x.id)
-        self._extend_unique_until(establishments, items_of_type(all_places, Establishment), 5, key=lambda x: x.id)
-
-        landmarks.sort(key=lambda x: cast(Landmark, x).priority.value, reverse=True)
-        establishments.sort(key=lambda x: cast(Establishment, x).priority.value, reverse=True)
-
-        prompt_landmarks = [x.model_dump() for x in landmarks]
-        prompt_establishments = [x.model_dump() for x in establishments]
-        prompt_events = [x.model_dump() for x in events]
+    @staticmethod
+    def _split_places_across_days(places_by_type: dict[type, list[Place]], total_days: int) -> list[list[Place]]:
+        """
+        Deal the landmarks and establishments out to the days round-robin, highest priority first, so that each day
+        is offered a different but equally strong selection. Events are not dealt out, they belong to their own date.
+        """
+        pools: list[list[Place]] = [[] for _ in range(total_days)]
+
+        for place_type in (Landmark, Establishment):
+            ranked = sorted(places_by_type.get(place_type, []), key=lambda x: x.priority.value, reverse=True)
+            for i, place in enumerate(ranked):
+                pools[i % total_days].append(place)
+
+        return pools
+
+    def _create_day_prompt(self,
+                           trip_request: TripRequest,
+                           all_places_by_type: dict[type, list[Place]],
+                           available_places: list[Place],
+                           events: list[Event],
+                           current_date: date,
+                           theme: str
+                           ) -> list[BaseMessage]:
+        self._log.info(f'🤔 Preparing activities for {current_date} with {len(available_places)} available places')
+
+        # Separate places by type (copies, since the lists are extended and sorted below)
+        available = bucket_by_type(available_places)
+        landmarks: list[Place] = list(available.get(Landmark, []))
+        establishments: list[Place] = list(available.get(Establishment, []))
+        events = list(events)
+
+        seen_ids: set[object] = {x.id for x in available_places}
+        self._extend_unique_until(landmarks, all_places_by_type.get(Landmark, []), 5, key=lambda x: x.id,
+                                  seen=seen_ids)
+        self._extend_unique_until(establishments, all_places_by_type.get(Establishment, []), 5, key=lambda x: x.id,
+                                  seen=seen_ids)
+
+        # Ties are broken by id, so that the same places always produce the same prompt (and hit the response cache)
+        landmarks.sort(key=lambda x: (-cast(Landmark, x).priority.value, str(x.id)))
+        establishments.sort(key=lambda x: (-cast(Establishment, x).priority.value, str(x.id)))
+        events.sort(key=lambda x: (x.date_and_time, str(x.id)))
+
+        prompt_landmarks = self._to_prompt_json(landmarks)
+        prompt_establishments = self._to_prompt_json(establishments)
+        prompt_events = self._to_prompt_json(events)
 
         prompt = f"""
         Consider the following places:
@@ -153,35 +264,63 @@ class ScheduleBuilder:
         Your job is to design personalized travel plans
         """
 
-        response = (self._llm
-        .with_structured_output(schema=DailyActivities)
-        .invoke(input=[
+        return [
             SystemMessage(content=role),
             HumanMessage(content=prompt)
-        ]))
+        ]
 
+    @staticmethod
+    def _to_activities(
+            response: Any,
+            places_by_id: dict[uuid.UUID, Place],
+            current_date: date
+    ) -> list[ItineraryActivity]:
+        activities = response.activities if isinstance(response, DailyActivities) else (
+            response if isinstance(response, list) else [])
+
+        # Skip any place id the LLM made up instead of failing the whole day
         return [
             ItineraryActivityFactory.from_place(
-                place=next(place for place in all_places if place.id == activity.place_id),
+                place=place,
                 start_time=datetime.combine(current_date, activity.start_time),
                 duration_hours=activity.duration_hours
-            ) for activity in (response.activities if isinstance(response, DailyActivities) else (
-                response if isinstance(response, list) else None))
+            ) for activity in activities
+            if (place := places_by_id.get(activity.place_id)) is not None
         ]
 
+    def _to_prompt_json(self, places: Iterable[Place]) -> str:
+        """
+        Serialize places for a prompt. Each place is dumped only once per builder, since the same places are offered
+        to the LLM on many days.
+        """
+        dumps: list[dict[str, Any]] = []
+
+        for place in places:
+            dumped = self._place_dumps.get(place.id)
+            if dumped is None:
+                dumped = self._place_dumps[place.id] = _place_for_day_prompt(place)
+            dumps.append(dumped)
+
+        return json.dumps(dumps, ensure_ascii=False, separators=(',', ':'))
+
     def _extend_unique_until(
             self,
             dest: list[T],
             src: Iterable[T],
             target_count: int,
             key: Callable[[T], object],
+            seen: set[object] | None = None
     ) -> None:
         """
         Append items from src into dest until len(dest) == target_count,
         skipping duplicates. Key(item) determines duplicates 
+        :param seen: Keys that are already taken. When given, it must contain the keys of dest and is updated in place,
+        so it can be shared between calls.
         """
+        if len(dest) >= target_count:
+            return
 
-        seen_keys = {key(x) for x in dest}
+        seen_keys = seen if seen is not None else {key(x) for x in dest}
         added = 0
 
         for item in src:
@@ -196,42 +335,70 @@ class ScheduleBuilder:
         if added >= 1:
             self._log.info(f'Extending: {added} more.')
 
-    def _get_travel_segment_options(self) -> TravelSegmentOptions:
-        prompt = """
-        Search for trusted sources on transport fares. Specifically:
+    @staticmethod
+    def _fare_cache_key(destination: str) -> str:
+        return f'fares:{destination.strip().lower()}:v1'
+
+    @staticmethod
+    def _fare_prompt(destination: str) -> str:
+        return f"""
+        Search for trusted sources on transport fares in {destination}. Specifically:
         - The standard public transport fare (average for buses, metro, etc.)
         - The base taxi fare
         
         Convert all currencies to EUR.
         """
 
-        self._log.info("🚌🚇 Searching for public transport fares")
+    def _get_cached_fares(self, destination: str) -> TravelSegmentOptions | None:
+        cached = fare_cache.get(self._fare_cache_key(destination))
+        if cached is None:
+            self._log.info("🚌🚇 Searching for public transport fares")
+            return None
+
+        self._log.info(f"🚌🚇 Using cached transport fares for {destination}")
+        return TravelSegmentOptions.model_validate_json(cached)
 
-        response = self._llm.with_structured_output(schema=TravelSegmentOptions).invoke(input=prompt)
+    def _get_travel_segment_options(self, destination: str) -> TravelSegmentOptions:
+        cached = self._get_cached_fares(destination)
+        if cached is not None:
+            return cached
+
+        response = (self._llm_fast
+                    .with_structured_output(schema=TravelSegmentOptions)
+                    .invoke(input=self._fare_prompt(destination)))
 
         assert isinstance(response, TravelSegmentOptions)
 
+        fare_cache.set(self._fare_cache_key(destination), response.model_dump_json())
+
         return response
 
-    def calculate_travel_segments(self, activities: list[ItineraryActivity], options: TravelSegmentOptions) -> list[
-        TravelSegment]:
-        travel_segments: list[TravelSegment] = []
+    async def _aget_travel_segment_options(self, destination: str) -> TravelSegmentOptions:
+        cached = self._get_cached_fares(destination)
+        if cached is not None:
+            return cached
 
-        for i in range(len(activities) - 1):
-            current_activity = activities[i]
-            next_activity = activities[i + 1]
+        response = await (self._llm_fast
+                          .with_structured_output(schema=TravelSegmentOptions)
+                          .ainvoke(input=self._fare_prompt(destination)))
 
-            if current_activity.coordinates is None or next_activity.coordinates is None:
-                continue
+        assert isinstance(response, TravelSegmentOptions)
 
-            # This can happen, we skip here
-            if current_activity.start_time == next_activity.start_time:
-                continue
+        fare_cache.set(self._fare_cache_key(destination), response.model_dump_json())
 
-            segment = self.calculate_travel_segment(current_activity, next_activity, options)
-            travel_segments.append(segment)
+        return response
 
-        return travel_segments
+    def calculate_travel_segments(self, activities: list[ItineraryActivity], options: TravelSegmentOptions) -> list[
+        TravelSegment]:
+        # Single pass over consecutive pairs. Pairs without coordinates, or starting at the same time (this can
+        # happen), are skipped
+        return [
+            self.calculate_travel_segment(current_activity, next_activity, options)
+            for current_activity, next_activity in zip(activities, activities[1:])
+            if current_activity.coordinates is not None
+               and next_activity.coordinates is not None
+               and current_activity.start_time != next_activity.start_time
+        ]
 
     @staticmethod
     def calculate_travel_segment(
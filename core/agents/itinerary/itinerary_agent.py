@@ -1,14 +1,16 @@
 ﻿from typing import List, Optional, Any
 
 from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph
 from pydantic import BaseModel, Field
 
 from core.agents.base import BaseAgent
+from core.agents.cache import CachedChatModel
 from core.agents.itinerary.accommodation_choice import select_best_accommodation
 from core.agents.itinerary.budget import validate_budget, BudgetTracker, create_budget_breakdown
 from core.agents.itinerary.day_itinerary_builder import ScheduleBuilder
-from core.agents.itinerary.themes import DailyThemes, generate_daily_themes
+from core.agents.itinerary.themes import DailyThemes, generate_daily_themes, agenerate_daily_themes
 from core.agents.null_checks import require
 from core.models.itinerary import DayItinerary, TripItinerary
 from core.models.places import DestinationReport, Accommodation
@@ -25,7 +27,9 @@ class ItineraryAgentInput(BaseModel):
 
 
 class ItineraryState(BaseModel):
-    """State object passed between nodes in the itinerary building workflow"""
+    """
+    State object passed between nodes in the itinerary building workflow. Nodes return only the fields they changed.
+    """
     trip_request: TripRequest = Field(
         description="The user's initial input."
     )
@@ -56,10 +60,21 @@ class ItineraryState(BaseModel):
 
 
 class ItineraryBuilderAgent(BaseAgent):
-    def __init__(self, llm: BaseChatModel):
+    def __init__(
+            self,
+            llm: BaseChatModel,
+            llm_fast: BaseChatModel | None = None
+    ):
+        """
+        :param llm: The chat model used for building the daily schedules (and every other step, unless `llm_fast` is
+        given)
+        :param llm_fast: Optional smaller/faster chat model for the simple steps: daily themes and transport fares
+        """
         super().__init__(name='itinerary_builder')
         self.workflow = self._create_workflow().compile()
-        self._llm = llm
+
+        self._llm = CachedChatModel(llm)
+        self._llm_fast = CachedChatModel(llm_fast) if llm_fast is not None else self._llm
 
     def invoke(self, request: TripRequest, destination_report: DestinationReport) -> TripItinerary:
         state_input = ItineraryAgentInput(
@@ -70,6 +85,16 @@ class ItineraryBuilderAgent(BaseAgent):
 
         return final_state['final_itinerary']
 
+    async def ainvoke(self, request: TripRequest, destination_report: DestinationReport) -> TripItinerary:
+        """Same as `invoke`, but the LLM calls are awaited instead of blocking."""
+        state_input = ItineraryAgentInput(
+            trip_request=request,
+            destination_report=destination_report)
+
+        final_state = await self.workflow.ainvoke(input=state_input)
+
+        return final_state['final_itinerary']
+
     def _create_workflow(self) -> StateGraph[ItineraryState, Any, ItineraryAgentInput, Any]:
         workflow = StateGraph(
             input_schema=ItineraryAgentInput,
@@ -77,9 +102,11 @@ class ItineraryBuilderAgent(BaseAgent):
         )
 
         (workflow
-         .add_node('plan_themes', self._plan_daily_themes)
+         # The nodes that call the LLM get an async variant, which is used when the workflow runs with `ainvoke`
+         .add_node('plan_themes', RunnableLambda(self._plan_daily_themes, afunc=self._aplan_daily_themes))
          .add_node('allocate_accommodation', self._allocate_accommodation)
-         .add_node('build_daily_schedules', self._build_daily_schedules)
+         .add_node('build_daily_schedules',
+                   RunnableLambda(self._build_daily_schedules, afunc=self._abuild_daily_schedules))
          .add_node('validate_budget_constraints', self._validate_budget_constraints)
          .add_node('finalize_itinerary', self._finalize_itinerary))
 
@@ -100,49 +127,80 @@ class ItineraryBuilderAgent(BaseAgent):
 
         return workflow
 
-    def _plan_daily_themes(self, state: ItineraryState) -> ItineraryState:
+    def _plan_daily_themes(self, state: ItineraryState) -> dict[str, DailyThemes]:
         """Plan themes for each day based on interests and selected places"""
         self._log.info("❓ Generate themes for each day")
 
-        state.daily_themes = generate_daily_themes(self._llm, state.trip_request, state.destination_report.all_places)
+        daily_themes = generate_daily_themes(
+            self._llm_fast,
+            state.trip_request,
+            state.destination_report.all_places)
+
+        return {'daily_themes': daily_themes}
+
+    async def _aplan_daily_themes(self, state: ItineraryState) -> dict[str, DailyThemes]:
+        self._log.info("❓ Generate themes for each day")
+
+        daily_themes = await agenerate_daily_themes(
+            self._llm_fast,
+            state.trip_request,
+            state.destination_report.all_places)
 
-        return state
+        return {'daily_themes': daily_themes}
 
-    def _allocate_accommodation(self, state: ItineraryState) -> ItineraryState:
+    def _allocate_accommodation(self, state: ItineraryState) -> dict[str, Accommodation]:
         self._log.info("🏨 Generating accommodation activities")
 
         trip_request: TripRequest = state.trip_request
         accommodations = state.destination_report.accommodations.report
 
-        state.accommodation = select_best_accommodation(accommodations, trip_request)
-        return state
+        accommodation = select_best_accommodation(accommodations, trip_request)
+        return {'accommodation': accommodation}
+
+    def _build_daily_schedules(self, state: ItineraryState) -> dict[str, List[DayItinerary]]:
+        self._log.info("📆 Building daily schedules")
+
+        # A budget tracker only exists once a schedule has been validated, so this is a re-plan
+        schedule_builder = ScheduleBuilder(
+            self._llm,
+            refresh_activities=state.budget_tracker is not None,
+            llm_fast=self._llm_fast)
+
+        daily_itineraries = schedule_builder.build(
+            state.trip_request,
+            state.destination_report.all_places,
+            require(state.daily_themes))
+
+        return {'daily_itineraries': daily_itineraries}
 
-    def _build_daily_schedules(self, state: ItineraryState) -> ItineraryState:
+    async def _abuild_daily_schedules(self, state: ItineraryState) -> dict[str, List[DayItinerary]]:
         self._log.info("📆 Building daily schedules")
 
-        schedule_builder = ScheduleBuilder(self._llm)
+        schedule_builder = ScheduleBuilder(
+            self._llm,
+            refresh_activities=state.budget_tracker is not None,
+            llm_fast=self._llm_fast)
 
-        state.daily_itineraries = schedule_builder.build(
+        daily_itineraries = await schedule_builder.abuild(
             state.trip_request,
             state.destination_report.all_places,
             require(state.daily_themes))
 
-        return state
+        return {'daily_itineraries': daily_itineraries}
 
-    def _validate_budget_constraints(self, state: ItineraryState) -> ItineraryState:
+    def _validate_budget_constraints(self, state: ItineraryState) -> dict[str, BudgetTracker]:
         self._log.info("💵 Validating budget constraints")
 
         budget_tracker = validate_budget(state.trip_request, state.daily_itineraries)
-        state.budget_tracker = budget_tracker
-        return state
+        return {'budget_tracker': budget_tracker}
 
-    def _finalize_itinerary(self, state: ItineraryState) -> ItineraryState:
+    def _finalize_itinerary(self, state: ItineraryState) -> dict[str, TripItinerary]:
         """Create the final itinerary object"""
         self._log.info('Creating the final itinerary')
 
         trip_request = state.trip_request
 
-        state.final_itinerary = TripItinerary(
+        final_itinerary = TripItinerary(
             initial_request=state.trip_request,
             total_days=(trip_request.end_date - trip_request.start_date).days + 1,
             daily_itineraries=state.daily_itineraries,
@@ -151,7 +209,7 @@ class ItineraryBuilderAgent(BaseAgent):
                                                      trip_request.travelers),
         )
 
-        return state
+        return {'final_itinerary': final_itinerary}
 
     def _should_replan(self, state: ItineraryState) -> str:
         """Decide whether to replan based on budget validation"""
@@ -1,50 +1,81 @@
 ﻿from typing import List, cast
 
 from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 from pydantic import BaseModel, Field
 
+from core.agents.cache import CachedChatModel
 from core.models.places import Place
 from core.models.trip import TripRequest
 
+THEMES_INSTRUCTIONS = """
+You plan a theme for each day of a trip.
+
+Create logical themes that:
+1. Group related activities/areas together
+2. Consider travel logistics (don't zigzag across the city)
+3. Balance must-see attractions with interests
+4. Account for opening hours and booking requirements
+
+Return only a list of theme names, one per day.
+"""
+
 
 class DailyThemes(BaseModel):
     list: List[str] = Field(description="A list containing a theme for each day of the trip")
 
-    def add_additional_themes_if_incomplete(self, required_num: int) -> None:
-        self.list.extend([f"Exploration Day {i + 1}" for i in range(len(self.list), required_num)])
+    def fit_to_days(self, total_days: int) -> None:
+        """Pads or truncates the themes, so that there is exactly one per day."""
+        del self.list[total_days:]
+        self.list.extend([f"Exploration Day {i + 1}" for i in range(len(self.list), total_days)])
+
+
+def generate_daily_themes(
+        llm: BaseLanguageModel | CachedChatModel,
+        request: TripRequest,
+        places: list[Place]
+) -> DailyThemes:
+    try:
+        theme_llm = llm.with_structured_output(schema=DailyThemes)
+        response = cast(DailyThemes, theme_llm.invoke(input=_themes_prompt(request, places)))
+        response.fit_to_days(request.total_days)
+        return response
+    except Exception:
+        return _fallback_themes(request.total_days)
 
 
-def generate_daily_themes(llm: BaseLanguageModel, request: TripRequest, places: list[Place]) -> DailyThemes:
-    def _generate_themes_with_llm(prompt: str, total_days: int) -> DailyThemes:
+async def agenerate_daily_themes(
+        llm: BaseLanguageModel | CachedChatModel,
+        request: TripRequest,
+        places: list[Place]
+) -> DailyThemes:
+    """Same as `generate_daily_themes`, but awaits the LLM call."""
+    try:
         theme_llm = llm.with_structured_output(schema=DailyThemes)
+        response = cast(DailyThemes, await theme_llm.ainvoke(input=_themes_prompt(request, places)))
+        response.fit_to_days(request.total_days)
+        return response
+    except Exception:
+        return _fallback_themes(request.total_days)
 
-        try:
-            response = cast(DailyThemes, theme_llm.invoke(input=prompt))
-            response.add_additional_themes_if_incomplete(required_num=total_days)
-            return response
-        except Exception:
-            fallback_themes = [
-                "Historic City Center", "Museums & Culture", "Local Neighborhoods",
-                "Nature & Parks", "Food & Markets", "Hidden Gems", "Relaxation Day"
-            ]
-            return DailyThemes(list=(fallback_themes * ((total_days // len(fallback_themes)) + 1))[:total_days])
-
-    # Use LLM to generate logical daily themes
-    themes_prompt = f"""
+
+def _fallback_themes(total_days: int) -> DailyThemes:
+    fallback_themes = [
+        "Historic City Center", "Museums & Culture", "Local Neighborhoods",
+        "Nature & Parks", "Food & Markets", "Hidden Gems", "Relaxation Day"
+    ]
+    return DailyThemes(list=(fallback_themes * ((total_days // len(fallback_themes)) + 1))[:total_days])
+
+
+def _themes_prompt(request: TripRequest, places: list[Place]) -> list[BaseMessage]:
+    return [
+        SystemMessage(THEMES_INSTRUCTIONS),
+        HumanMessage(f"""
         Plan {request.total_days} daily themes for a trip to {request.destination}.
         
         Trip details:
         {request.format_for_llm()}
         
         Available places: {len(places)} locations
-        
-        Create logical themes that:
-        1. Group related activities/areas together
-        2. Consider travel logistics (don't zigzag across the city)
-        3. Balance must-see attractions with interests
-        4. Account for opening hours and booking requirements
-        
-        Return only a list of theme names, one per day.
-        """
-
-    return _generate_themes_with_llm(themes_prompt, request.total_days)
+        """)
+    ]
@@ -2,18 +2,33 @@
 from typing import Annotated, Any, Literal
 
 from langchain_core.language_models import BaseChatModel
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph
 from pydantic import BaseModel, Field
 
 from core.agents.base import BaseAgent
 from core.agents.null_checks import require
+from core.agents.places.places_utils import to_json, place_for_llm
 from core.agents.state import SearchInfo
 from core.models.places import Place, PlaceCategory, AccommodationReport
 from core.models.trip import TripRequest
 from core.tools.foursquare import FoursquareApiClient, PlaceSearchRequest, convert_fsq_to_place
-from core.tools.tools import get_available_tools
-from core.utils import invoke_react_agent
+from core.utils import create_structured_react_agent, run_react_agent, arun_react_agent
+
+REPORT_INSTRUCTIONS = """
+You are given a list of available accommodation options in a destination along with additional information.
+
+Your task is to curate a list of accommodations that best fit the "trip request" criteria.
+
+For each recommendation pay special attention to:
+- The prices (consider the travellers' budget, group size and duration of stay)
+
+Limit your recommendations to a maximum of 10.
+"""
+
+# Twice the number of recommendations, which leaves the LLM enough to choose from without paying for unused candidates
+DEFAULT_TOP_K = 20
 
 
 class AccommodationState(BaseModel):
@@ -27,6 +42,12 @@ class AccommodationState(BaseModel):
         default=None
     )
     local_info: SearchInfo = Field()
+    top_k: int = Field(
+        description='How many accommodation candidates to search for',
+        gt=0,
+        le=50,
+        default=DEFAULT_TOP_K
+    )
 
 
 class AccommodationScoutAgent(BaseAgent):
@@ -34,10 +55,18 @@ class AccommodationScoutAgent(BaseAgent):
     Researches hotels and places of accommodation for a given destination and curates them based on the user's travel profile.
     """
 
-    def __init__(self, llm: BaseChatModel, client: FoursquareApiClient):
+    def __init__(self, llm: BaseChatModel, client: FoursquareApiClient, top_k: int = DEFAULT_TOP_K):
+        """
+        :param top_k: How many accommodation candidates are fetched from Foursquare for the LLM to choose from
+        """
         super().__init__(name='accommodation_scout')
-        self._llm = llm.bind_tools(get_available_tools())
+        self._llm = llm
         self._client = client
+        self._top_k = top_k
+        self._report_agent = create_structured_react_agent(
+            self._llm,
+            AccommodationReport,
+            system_message=SystemMessage(REPORT_INSTRUCTIONS))
         self.workflow = self._create_workflow().compile()
 
     def _create_workflow(self) -> StateGraph[AccommodationState, Any, AccommodationState, AccommodationState]:
@@ -48,8 +77,11 @@ class AccommodationScoutAgent(BaseAgent):
         )
 
         workflow.add_node('expand_search', self._expand_search)
-        workflow.add_node('find_accommodations', self._search_for_accommodations)
-        workflow.add_node('generate_accommodation_report', self._get_finalized_accommodation_report)
+        workflow.add_node('find_accommodations', RunnableLambda(
+            self._search_for_accommodations, afunc=self._asearch_for_accommodations))
+        workflow.add_node('generate_accommodation_report', RunnableLambda(
+            self._get_finalized_accommodation_report,
+            afunc=self._aget_finalized_accommodation_report))
 
         workflow.set_entry_point('find_accommodations')
         workflow.add_conditional_edges(
@@ -70,12 +102,18 @@ class AccommodationScoutAgent(BaseAgent):
     def invoke(self, request: TripRequest, info: SearchInfo) -> AccommodationReport:
         self._log.info('🔎 Researching accommodations')
 
-        initial_state = AccommodationState(
-            trip_request=request,
-            local_info=info
-        )
+        return self._get_report(self.workflow.invoke(input=self._initial_state(request, info)))
 
-        final_state = self.workflow.invoke(input=initial_state)
+    async def ainvoke(self, request: TripRequest, info: SearchInfo) -> AccommodationReport:
+        self._log.info('🔎 Researching accommodations')
+
+        return self._get_report(await self.workflow.ainvoke(input=self._initial_state(request, info)))
+
+    def _initial_state(self, request: TripRequest, info: SearchInfo) -> AccommodationState:
+        return AccommodationState(trip_request=request, local_info=info, top_k=self._top_k)
+
+    @staticmethod
+    def _get_report(final_state: dict[str, Any]) -> AccommodationReport:
         report = final_state['report']
 
         assert isinstance(report, AccommodationReport)
@@ -85,38 +123,53 @@ class AccommodationScoutAgent(BaseAgent):
     def _get_finalized_accommodation_report(self, state: AccommodationState) -> dict[str, AccommodationReport]:
         self._log.info('🏨 Generating final accommodation report...')
 
-        prompt = f"""
-                You are given a list of available accommodation options in {state.trip_request.destination} along with additional information:
-                
-                {state.model_dump_json()}
-                
-                Your task is to curate a list of accommodations that best fit the "trip request" criteria.
-                
-                For each recommendation pay special attention to:
-                - The prices (consider the travellers' budget, group size and duration of stay)
+        return {'report': run_react_agent(self._report_agent, [self._report_message(state)], AccommodationReport)}
+
+    async def _aget_finalized_accommodation_report(self, state: AccommodationState) -> dict[str, AccommodationReport]:
+        self._log.info('🏨 Generating final accommodation report...')
+
+        return {'report': await arun_react_agent(self._report_agent, [self._report_message(state)], AccommodationReport)}
+
+    @staticmethod
+    def _report_message(state: AccommodationState) -> HumanMessage:
+        return HumanMessage(f"""
+                Destination: {state.trip_request.destination}
                 
-                Limit your recommendations to a maximum of 10.
-                """
+                {to_json(AccommodationScoutAgent._prompt_payload(state))}
+                """)
 
-        return {'report': invoke_react_agent(self._llm, [HumanMessage(prompt)], schema=AccommodationReport)}
+    @staticmethod
+    def _prompt_payload(state: AccommodationState) -> dict[str, Any]:
+        """Only the fields the LLM needs (the search area and the empty report are left out)."""
+        return {
+            'trip_request': state.trip_request.model_dump(mode='json'),
+            'accommodations': [place_for_llm(p) for p in state.accommodations]
+        }
 
     @staticmethod
     def _has_no_accommodations(state: AccommodationState) -> Literal['has_no_accommodations', 'found_accommodations']:
         return 'has_no_accommodations' if not state.accommodations else 'found_accommodations'
 
     def _search_for_accommodations(self, state: AccommodationState) -> dict[str, list[Place]]:
-        place_search_request = PlaceSearchRequest(
-            center=require(state.local_info).center,
-            radius=require(state.local_info).radius,
-            place_categories=[PlaceCategory.HOTEL],
-            limit=35
-        )
+        place_search_response = require(self._client.search(self._search_request(state)))
 
-        place_search_response = require(self._client.search(place_search_request))
+        return {'accommodations': [convert_fsq_to_place(fsq) for fsq in place_search_response.results]}
 
-        accommodations = [convert_fsq_to_place(fsq) for fsq in place_search_response.results]
+    async def _asearch_for_accommodations(self, state: AccommodationState) -> dict[str, list[Place]]:
+        place_search_response = require(await self._client.asearch(self._search_request(state)))
 
-        return {'accommodations': accommodations}
+        return {'accommodations': [convert_fsq_to_place(fsq) for fsq in place_search_response.results]}
+
+    @staticmethod
+    def _search_request(state: AccommodationState) -> PlaceSearchRequest:
+        info = require(state.local_info)
+
+        return PlaceSearchRequest(
+            center=info.center,
+            radius=info.radius,
+            place_categories=[PlaceCategory.HOTEL],
+            limit=state.top_k
+        )
 
     @staticmethod
     def _expand_search(state: AccommodationState) -> dict[str, SearchInfo]:
@@ -1,6 +1,8 @@
-﻿from typing import Any
+﻿import operator
+from typing import Annotated, Any, Awaitable, Callable, Iterator
 
 from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import RunnableLambda
 from langgraph.constants import END
 from langgraph.graph import StateGraph
 from pydantic import BaseModel, Field
@@ -10,7 +12,8 @@ from core.agents.places.accommodation_scout import AccommodationScoutAgent
 from core.agents.places.establishment_scout import EstablishmentScoutAgent
 from core.agents.places.event_scout import EventScoutAgent
 from core.agents.places.landmark_scout import LandmarkScoutAgent
-from core.agents.state import SearchInfo, determine_search
+from core.agents.state import SearchInfo, determine_search, adetermine_search, search_info_cache, \
+    search_info_cache_key, create_search_agent
 from core.models.places import DestinationReport, LandmarksReport, EstablishmentReport, EventsReport, \
     AccommodationReport
 from core.models.trip import TripRequest
@@ -24,21 +27,70 @@ class DestinationState(BaseModel):
     events: EventsReport = Field()
     accommodations: AccommodationReport = Field()
     info: SearchInfo = Field()
+    failures: Annotated[dict[str, str], operator.or_] = Field(
+        description='The error of every scout that failed, by report name',
+        default_factory=dict
+    )
+
+
+# Without these reports no itinerary can be built, the events report is optional
+REQUIRED_REPORTS = ('landmarks', 'establishments', 'accommodations')
 
 
 class DestinationScoutAgent(BaseAgent):
     """
     Agent that composes other scout agents and executes them in parallel (https://langchain-ai.github.io/langgraph/tutorials/workflows/#parallelization)
+
+    The four research nodes share a single superstep, so LangGraph runs them concurrently: with `invoke` they are
+    dispatched to its thread pool, with `ainvoke` their async variants run on the event loop. Keep them free of shared
+    mutable state.
+
+    A failing scout does not cancel the others: its error is recorded in `failures`, and once all scouts have joined,
+    a failure of a required scout is raised.
     """
 
     def __init__(self, llm: BaseChatModel, client: FoursquareApiClient):
         super().__init__(name='destination_scout')
         self._client = client
         self._llm = llm
+        self._search_agent = create_search_agent(llm)
+        self._landmark_scout = LandmarkScoutAgent(llm, client)
+        self._event_scout = EventScoutAgent(llm)
+        self._establishment_scout = EstablishmentScoutAgent(llm, client)
+        self._accommodation_scout = AccommodationScoutAgent(llm, client)
         self.workflow = self._create_workflow().compile()
 
     def invoke(self, request: TripRequest) -> DestinationReport:
-        initial_state = DestinationState(
+        final_state = self.workflow.invoke(input=self._initial_state(request))
+
+        return self._to_report(final_state)
+
+    def stream(self, request: TripRequest) -> Iterator[tuple[str, BaseModel]]:
+        """
+        Yields each report as soon as its scout finishes, as `(name, report)` pairs (e.g. `('landmarks', report)`),
+        instead of waiting for the slowest scout.
+        """
+        failures: dict[str, str] = {}
+
+        for update in self.workflow.stream(input=self._initial_state(request), stream_mode='updates'):
+            for node_update in update.values():
+                for name, value in node_update.items():
+                    if name == 'failures':
+                        failures |= value
+                    elif name != 'info':
+                        yield name, value
+
+        self._raise_on_required_failures(failures)
+
+    async def ainvoke(self, request: TripRequest) -> DestinationReport:
+        """Same as `invoke`, but the scouts await their LLM calls, so their I/O overlaps on a single event loop."""
+        final_state = await self.workflow.ainvoke(input=self._initial_state(request))
+
+        return self._to_report(final_state)
+
+    @staticmethod
+    def _initial_state(request: TripRequest) -> DestinationState:
+        return DestinationState(
             trip_request=request,
             landmarks=LandmarksReport(report=[]),
             establishments=EstablishmentReport(report=[]),
@@ -47,7 +99,9 @@ class DestinationScoutAgent(BaseAgent):
             info=SearchInfo()
         )
 
-        final_state = self.workflow.invoke(input=initial_state)
+    @classmethod
+    def _to_report(cls, final_state: dict[str, Any]) -> DestinationReport:
+        cls._raise_on_required_failures(final_state['failures'])
 
         return DestinationReport(
             landmarks=final_state['landmarks'],
@@ -56,17 +110,27 @@ class DestinationScoutAgent(BaseAgent):
             accommodations=final_state['accommodations']
         )
 
+    @staticmethod
+    def _raise_on_required_failures(failures: dict[str, str]) -> None:
+        required = {name: error for name, error in failures.items() if name in REQUIRED_REPORTS}
+        if required:
+            raise RuntimeError(f'Required scouts failed: {required}')
+
     def _create_workflow(self) -> StateGraph[DestinationState, Any, DestinationState, DestinationState]:
         workflow = StateGraph(
             state_schema=DestinationState,
             input_schema=DestinationState,
             output_schema=DestinationState)
 
-        workflow.add_node('get_search_info', self._get_search_info)
-        workflow.add_node('landmarks', self._research_landmarks)
-        workflow.add_node('events', self._research_events)
-        workflow.add_node('establishments', self._research_establishments)
-        workflow.add_node('accommodations', self._research_accommodations)
+        workflow.add_node('get_search_info', RunnableLambda(self._get_search_info, afunc=self._aget_search_info))
+        workflow.add_node('landmarks', RunnableLambda(self._research_landmarks, afunc=self._aresearch_landmarks))
+        workflow.add_node('events', RunnableLambda(self._research_events, afunc=self._aresearch_events))
+        workflow.add_node('establishments', RunnableLambda(
+            self._research_establishments,
+            afunc=self._aresearch_establishments))
+        workflow.add_node('accommodations', RunnableLambda(
+            self._research_accommodations,
+            afunc=self._aresearch_accommodations))
 
         workflow.set_entry_point('get_search_info')
 
@@ -84,40 +148,93 @@ class DestinationScoutAgent(BaseAgent):
     def _get_search_info(self, state: DestinationState) -> dict[str, SearchInfo]:
         self._log.info('🔎 Getting search info...')
 
-        info = determine_search(state.trip_request, self._llm)
+        info = self._get_cached_search_info(state.trip_request)
+        if info is None:
+            info = determine_search(state.trip_request, self._llm, agent=self._search_agent)
+            search_info_cache.set(search_info_cache_key(state.trip_request), info.model_dump_json())
 
         self._log.info(f'🔎 Got search info: R = {info.radius}, LL = {info.center.to_string()}')
 
         return {'info': info}
 
-    def _research_landmarks(self, state: DestinationState) -> dict[str, LandmarksReport]:
-        scout = LandmarkScoutAgent(self._llm, self._client)
-        result = scout.invoke(state.trip_request, state.info)
+    async def _aget_search_info(self, state: DestinationState) -> dict[str, SearchInfo]:
+        self._log.info('🔎 Getting search info...')
+
+        info = self._get_cached_search_info(state.trip_request)
+        if info is None:
+            info = await adetermine_search(state.trip_request, self._llm, agent=self._search_agent)
+            search_info_cache.set(search_info_cache_key(state.trip_request), info.model_dump_json())
+
+        self._log.info(f'🔎 Got search info: R = {info.radius}, LL = {info.center.to_string()}')
+
+        return {'info': info}
+
+    def _get_cached_search_info(self, request: TripRequest) -> SearchInfo | None:
+        cached = search_info_cache.get(search_info_cache_key(request))
+        if cached is None:
+            self._log.info(f'🔎 No cached search info for {request.destination}')
+            return None
+
+        self._log.info(f'⚡ Using cached search info for {request.destination}')
+        return SearchInfo.model_validate_json(cached)
+
+    def _research_landmarks(self, state: DestinationState) -> dict[str, Any]:
+        return self._finish('landmarks', lambda: self._landmark_scout.invoke(state.trip_request, state.info))
+
+    async def _aresearch_landmarks(self, state: DestinationState) -> dict[str, Any]:
+        return await self._afinish('landmarks', self._landmark_scout.ainvoke(state.trip_request, state.info))
+
+    def _research_events(self, state: DestinationState) -> dict[str, Any]:
+        return self._finish('events', lambda: self._event_scout.invoke(state.trip_request))
+
+    async def _aresearch_events(self, state: DestinationState) -> dict[str, Any]:
+        return await self._afinish('events', self._event_scout.ainvoke(state.trip_request))
+
+    def _research_establishments(self, state: DestinationState) -> dict[str, Any]:
+        return self._finish('establishments', lambda: self._establishment_scout.invoke(state.trip_request, state.info))
 
-        self._log.info(f'✅ Finished Landmarks (found {len(result.report)})')
+    async def _aresearch_establishments(self, state: DestinationState) -> dict[str, Any]:
+        return await self._afinish(
+            'establishments',
+            self._establishment_scout.ainvoke(state.trip_request, state.info))
 
-        return {'landmarks': result}
+    def _research_accommodations(self, state: DestinationState) -> dict[str, Any]:
+        return self._finish('accommodations', lambda: self._accommodation_scout.invoke(state.trip_request, state.info))
 
-    def _research_events(self, state: DestinationState) -> dict[str, EventsReport]:
-        scout = EventScoutAgent(self._llm)
-        result = scout.invoke(state.trip_request)
+    async def _aresearch_accommodations(self, state: DestinationState) -> dict[str, Any]:
+        return await self._afinish(
+            'accommodations',
+            self._accommodation_scout.ainvoke(state.trip_request, state.info))
 
-        self._log.info(f'✅ Finished Events (found {len(result.report)})')
+    def _finish(self, name: str, research: Callable[[], Any]) -> dict[str, Any]:
+        """
+        Runs a scout and returns its report as a state update. A failure is recorded instead of raised, so that it
+        does not cancel the scouts running next to it (see `_raise_on_required_failures`).
+        """
+        try:
+            result = research()
+        except Exception as e:
+            return self._failed(name, e)
 
-        return {'events': result}
+        return self._finished(name, result)
 
-    def _research_establishments(self, state: DestinationState) -> dict[str, EstablishmentReport]:
-        scout = EstablishmentScoutAgent(self._llm, self._client)
-        result = scout.invoke(state.trip_request, state.info)
+    async def _afinish(self, name: str, research: Awaitable[Any]) -> dict[str, Any]:
+        try:
+            result = await research
+        except Exception as e:
+            return self._failed(name, e)
 
-        self._log.info(f'✅ Finished Establishments (found {len(result.report)})')
+        return self._finished(name, result)
 
-        return {'establishments': result}
+    def _finished(self, name: str, result: Any) -> dict[str, Any]:
+        self._log.info(f'✅ Finished {name.title()} (found {len(result.report)})')
 
-    def _research_accommodations(self, state: DestinationState) -> dict[str, AccommodationReport]:
-        scout = AccommodationScoutAgent(self._llm, self._client)
-        result = scout.invoke(state.trip_request, state.info)
+        return {name: result}
 
-        self._log.info(f'✅ Finished Accommodations (found {len(result.report)})')
+    def _failed(self, name: str, e: Exception) -> dict[str, Any]:
+        if name in REQUIRED_REPORTS:
+            self._log.error(f'❌ Failed {name.title()}', exc_info=e)
+        else:
+            self._log.error(f'❌ Failed {name.title()}, continuing without them', exc_info=e)
 
-        return {'accommodations': result}
+        return {'failures': {name: f'{type(e).__name__}: {e}'}}
@@ -1,22 +1,44 @@
-﻿import operator
+﻿import asyncio
+import operator
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import Annotated, Any, Literal, List, Dict
 
 from langchain_core.language_models import BaseChatModel
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
+from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph
 from pydantic import BaseModel, Field
 
 from core.agents.base import BaseAgent
 from core.agents.null_checks import require
-from core.agents.places.accommodation_scout import convert_fsq_to_place
+from core.agents.places.places_utils import to_json, place_for_llm, invoke_resumable, ainvoke_resumable, \
+    search_exhausted, MAX_SEARCH_RADIUS
 from core.agents.state import SearchInfo
 from core.models.geography import Coordinates
 from core.models.places import EstablishmentReport, Place, Establishment, Priority
 from core.models.trip import TripRequest
-from core.tools.foursquare import FoursquareApiClient, PlaceSearchRequest
-from core.tools.tools import get_available_tools
-from core.utils import invoke_react_agent
+from core.tools.foursquare import FoursquareApiClient, PlaceSearchRequest, FoursquarePlace, convert_fsq_to_place, \
+    is_within_radius, FoursquarePlaceSearchResponse
+from core.utils import create_structured_react_agent, run_react_agent, arun_react_agent
+
+MISSING_INFO_INSTRUCTIONS = """
+You are given a list of establishments (restaurants, cafes, bars, etc.) in a destination along with additional information.
+
+Your task is to gather the missing information for each establishment:
+- The coordinates of the establishment (only if they don't exist)
+- The average price of the establishment (per person)
+- The type of the establishment
+- Opening schedule/hours
+- Typical hours of stay (you can be granular if it is necessary)
+- The priority of the establishment
+
+Do not include/exclude any establishment from the given list
+"""
+
+# The most establishments sent in one details request
+DETAILS_CHUNK_SIZE = 20
 
 
 class MissingEstablishmentDetails(BaseModel):
@@ -64,6 +86,12 @@ class EstablishmentState(BaseModel):
         description='A list of the currently collected establishments',
         default_factory=list
     )
+    seen_place_ids: Annotated[set[str], operator.or_] = Field(
+        description='The Foursquare IDs of every place returned so far, so that repeated searches skip them',
+        default_factory=set
+    )
+    search_rounds: int = Field(description='How many search rounds were run so far', default=0)
+    found_in_last_round: int = Field(description='How many new places the last search round found', default=0)
     extra_establishment_details: Annotated[list[MissingEstablishmentDetails], operator.add] = Field(
         description='A list of the currently collected additional establishment information',
         default_factory=list
@@ -82,9 +110,13 @@ class EstablishmentScoutAgent(BaseAgent):
 
     def __init__(self, llm: BaseChatModel, client: FoursquareApiClient):
         super().__init__('establishment_scout')
-        self._llm = llm.bind_tools(get_available_tools())
+        self._llm = llm
         self._client = client
-        self.workflow = self._create_workflow().compile()
+        self._details_agent = create_structured_react_agent(
+            self._llm,
+            EstablishmentDetails,
+            system_message=SystemMessage(MISSING_INFO_INSTRUCTIONS))
+        self.workflow = self._create_workflow().compile(checkpointer=MemorySaver())
 
     def _create_workflow(self) -> StateGraph[EstablishmentState, Any, EstablishmentState]:
         workflow = StateGraph(
@@ -94,8 +126,11 @@ class EstablishmentScoutAgent(BaseAgent):
         )
 
         workflow.add_node('expand_search_info', self._expand_search)
-        workflow.add_node('search_establishments', self._search_establishments)
-        workflow.add_node('fill_out_missing_establishment_info', self._fill_out_missing_establishment_info)
+        workflow.add_node('search_establishments', RunnableLambda(
+            self._search_establishments, afunc=self._asearch_establishments))
+        workflow.add_node('fill_out_missing_establishment_info', RunnableLambda(
+            self._fill_out_missing_establishment_info,
+            afunc=self._afill_out_missing_establishment_info))
         workflow.add_node('generate_report', self._generate_report)
 
         workflow.set_entry_point('search_establishments')
@@ -120,72 +155,150 @@ class EstablishmentScoutAgent(BaseAgent):
         str, list[MissingEstablishmentDetails]]:
         self._log.info('🍽️ Gathering additional information for establishments')
 
+        chunks = self._chunk_establishments(state.establishments)
+
+        def fill_out(chunk: list[Place]) -> EstablishmentDetails:
+            return run_react_agent(
+                self._details_agent,
+                [self._missing_info_message(state.trip_request.destination, chunk)],
+                EstablishmentDetails)
+
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            responses = list(executor.map(fill_out, chunks))
+
+        return {'extra_establishment_details': self._collect_details(state, responses)}
+
+    async def _afill_out_missing_establishment_info(self, state: EstablishmentState) -> dict[
+        str, list[MissingEstablishmentDetails]]:
+        self._log.info('🍽️ Gathering additional information for establishments')
+
+        responses = await asyncio.gather(*[
+            arun_react_agent(
+                self._details_agent,
+                [self._missing_info_message(state.trip_request.destination, chunk)],
+                EstablishmentDetails)
+            for chunk in self._chunk_establishments(state.establishments)
+        ])
+
+        return {'extra_establishment_details': self._collect_details(state, responses)}
+
+    @staticmethod
+    def _chunk_establishments(establishments: list[Place]) -> list[list[Place]]:
+        """
+        All establishments go into a single request, unless there are so many that the LLM could cut its answer
+        short. Then they are split into chunks that are requested concurrently.
+        """
+        size = DETAILS_CHUNK_SIZE
+        return [establishments[i:i + size] for i in range(0, len(establishments), size)] or [[]]
+
+    def _collect_details(
+            self,
+            state: EstablishmentState,
+            responses: list[EstablishmentDetails]
+    ) -> list[MissingEstablishmentDetails]:
+        details = [d for response in responses for d in response.establishments]
+
+        missing = len({e.id for e in state.establishments} - {d.establishment_id for d in details})
+        if missing:
+            self._log.warning(f'🍽️ No details were returned for {missing} establishments')
+
+        return details
+
+    @staticmethod
+    def _missing_info_message(destination: str, establishments: list[Place]) -> HumanMessage:
         prompt_context = {
-            'destination': state.trip_request.destination,
-            'establishments': [e.model_dump() for e in state.establishments]
+            'destination': destination,
+            'establishments': [place_for_llm(e) for e in establishments]
         }
 
-        prompt = f"""
-                You are given a list of establishments (restaurants, cafes, bars, etc.) in {state.trip_request.destination} along with additional information:
-                
-                {prompt_context}
-                
-                Your task is to gather the missing information for each establishment:
-                - The coordinates of the establishment (only if they don't exist)
-                - The average price of the establishment (per person)
-                - The type of the establishment
-                - Opening schedule/hours
-                - Typical hours of stay (you can be granular if it is necessary)
-                - The priority of the establishment
-                
-                Do not include/exclude any establishment from the given list
-                """
-
-        agent_response = invoke_react_agent(self._llm, [HumanMessage(prompt)], schema=EstablishmentDetails)
-
-        return {'extra_establishment_details': agent_response.establishments}
+        return HumanMessage(f"""
+                {to_json(prompt_context)}
+                """)
 
     def _needs_to_search_for_more_establishments(self, state: EstablishmentState) -> Literal[
         'needs_more_establishments', 'ok']:
-        state.establishments_to_retrieve -= len(state.establishments)
-
         est_left = state.establishments_to_retrieve
 
-        if est_left > 0:
-            self._log.info(f'🍴 Need to search for {est_left} more establishments')
-            return 'needs_more_establishments'
+        if est_left <= 0:
+            return 'ok'
 
-        return 'ok'
+        if search_exhausted(state.search_rounds, state.found_in_last_round, state.local_info):
+            self._log.info(f'🍴 No more establishments to find, continuing with {len(state.establishments)}')
+            return 'ok'
+
+        self._log.info(f'🍴 Need to search for {est_left} more establishments')
+        return 'needs_more_establishments'
 
     def _expand_search(self, state: EstablishmentState) -> dict[str, SearchInfo]:
         self._log.info('Expanding search')
         return {'local_info': state.local_info.expand_radius(5_000)}
 
-    def _search_establishments(self, state: EstablishmentState) -> dict[str, list[Place]]:
+    def _search_establishments(self, state: EstablishmentState) -> dict[str, Any]:
         self._log.info('🍴 Searching for establishment through Foursquare')
 
-        search_request = PlaceSearchRequest(
-            center=require(state.local_info).center,
-            radius=require(state.local_info).radius,
-            limit=state.establishments_to_retrieve,
-            query='dining'
-        )
+        search_requests = self._search_requests(state)
 
-        agent_response = require(self._client.search(search_request))
+        return self._collect_new_establishments(state, search_requests, self._client.search_many(search_requests))
+
+    async def _asearch_establishments(self, state: EstablishmentState) -> dict[str, Any]:
+        self._log.info('🍴 Searching for establishment through Foursquare')
 
-        establishments = [convert_fsq_to_place(fsq) for fsq in agent_response.results]
+        search_requests = self._search_requests(state)
+        responses = await self._client.asearch_many(search_requests)
+
+        return self._collect_new_establishments(state, search_requests, responses)
+
+    @staticmethod
+    def _search_requests(state: EstablishmentState) -> list[PlaceSearchRequest]:
+        # Search the current area and the next wider ones at once, so that the expand-and-retry loop is rarely needed
+        local_info = require(state.local_info)
+        search_areas = [local_info.expand_radius(i * 5_000) for i in range(3)]
+        return [
+            PlaceSearchRequest(
+                center=info.center,
+                radius=min(info.radius, MAX_SEARCH_RADIUS),
+                limit=state.establishments_to_retrieve,
+                query='dining'
+            ) for info in search_areas
+        ]
+
+    def _collect_new_establishments(
+            self,
+            state: EstablishmentState,
+            search_requests: list[PlaceSearchRequest],
+            responses: list[FoursquarePlaceSearchResponse | None]
+    ) -> dict[str, Any]:
+        unique: dict[str, FoursquarePlace] = {}
+        for request, response in zip(search_requests, responses):
+            for fsq in require(response).results:
+                if fsq.fsq_place_id not in state.seen_place_ids and is_within_radius(fsq, request):
+                    unique.setdefault(fsq.fsq_place_id, fsq)
+
+        new_places = list(unique.values())[:state.establishments_to_retrieve]
+        establishments = [convert_fsq_to_place(fsq) for fsq in new_places]
 
         self._log.info(f'🍴 Got {len(establishments)} establishments')
 
-        return {'establishments': establishments}
+        return {
+            'establishments': establishments,
+            'establishments_to_retrieve': state.establishments_to_retrieve - len(establishments),
+            'seen_place_ids': {fsq.fsq_place_id for fsq in new_places},
+            'search_rounds': state.search_rounds + 1,
+            'found_in_last_round': len(establishments)
+        }
 
     def _generate_report(self, state: EstablishmentState) -> dict[str, EstablishmentReport]:
         report: list[Establishment] = []
 
         self._log.info('🍸 Generating final establishment report')
 
+        by_id = {place.id: place for place in state.establishments}
+
         for details in state.extra_establishment_details:
-            target = next(x for x in state.establishments if x.id == details.establishment_id)
+            target = by_id.get(details.establishment_id)
+            if target is None:
+                self._log.warning(f'Skipping details for unknown establishment {details.establishment_id}')
+                continue
 
             if not target.coordinates or not details.coordinates:
                 self._log.error(f'{target.name} is missing coordinates ({target.coordinates}, {details.coordinates})')
@@ -201,14 +314,27 @@ class EstablishmentScoutAgent(BaseAgent):
     def invoke(self, request: TripRequest, info: SearchInfo) -> EstablishmentReport:
         self._log.info("🔎 Researching establishments...")
 
-        initial_state = EstablishmentState(
+        final_state = invoke_resumable(self.workflow, self._initial_state(request, info), self._log)
+
+        return self._get_report(final_state)
+
+    async def ainvoke(self, request: TripRequest, info: SearchInfo) -> EstablishmentReport:
+        self._log.info("🔎 Researching establishments...")
+
+        final_state = await ainvoke_resumable(self.workflow, self._initial_state(request, info), self._log)
+
+        return self._get_report(final_state)
+
+    @staticmethod
+    def _initial_state(request: TripRequest, info: SearchInfo) -> EstablishmentState:
+        return EstablishmentState(
             trip_request=request,
             establishments_to_retrieve=min(50, request.total_days * 5),
             local_info=info
         )
 
-        final_state = self.workflow.invoke(input=initial_state)
-
+    @staticmethod
+    def _get_report(final_state: dict[str, Any]) -> EstablishmentReport:
         report = final_state.get('report')
         if not report:
             raise ValueError(f"'report' not in final_state: {final_state}")
@@ -1,10 +1,24 @@
-﻿from langchain_core.language_models import BaseChatModel
-from langchain_core.messages import HumanMessage
+﻿from pathlib import Path
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import HumanMessage, SystemMessage
 
 from core.models.places import EventsReport
 from core.models.trip import TripRequest
 from ..base import BaseAgent
-from ...utils import invoke_react_agent
+from ..cache import DiskResponseCache
+from ...utils import create_structured_react_agent, run_react_agent, arun_react_agent
+
+# The prompt only depends on the trip request, so repeated requests reuse the events found in the past day
+event_cache = DiskResponseCache(Path.home() / '.travelplanner' / 'events', ttl_seconds=24 * 60 * 60)
+
+EVENT_INSTRUCTIONS = """
+You search for events taking place in a destination during a given period.
+
+Events include festivals, social, cultural & arts, sports, recreation, concerts, theatre, cinema, and more...
+Focus on events that would appeal to the given travelers.
+Return a maximum of 15 of the most relevant events to the travelers.
+"""
 
 
 class EventScoutAgent(BaseAgent):
@@ -15,24 +29,23 @@ class EventScoutAgent(BaseAgent):
     def __init__(self, llm: BaseChatModel):
         super().__init__('event_scout')
         self._llm = llm
+        self._agent = create_structured_react_agent(llm, EventsReport, system_message=SystemMessage(EVENT_INSTRUCTIONS))
 
     def invoke(self, req: TripRequest) -> EventsReport:
         self._log.info('🔎 Researching events at the time of the trip...')
 
-        response = invoke_react_agent(
-            llm=self._llm,
-            messages=[
-                HumanMessage(f"""
+        return run_react_agent(self._agent, [HumanMessage(self._prompt(req))], EventsReport, cache=event_cache)
+
+    async def ainvoke(self, req: TripRequest) -> EventsReport:
+        self._log.info('🔎 Researching events at the time of the trip...')
+
+        return await arun_react_agent(self._agent, [HumanMessage(self._prompt(req))], EventsReport, cache=event_cache)
+
+    @staticmethod
+    def _prompt(req: TripRequest) -> str:
+        return f"""
                 Search for events taking place in {req.destination} between {req.start_date} and {req.end_date}.
                 
-                Focus on events that would appeal to these travelers:
+                Travelers:
                 {req.format_for_llm()}
-                
-                Events include festivals, social, cultural & arts, sports, recreation, concerts, theatre, cinema, and more...
-                Return a maximum of 15 of the most relevant events to the travelers.
-                """)
-            ],
-            schema=EventsReport
-        )
-
-        return response
+                """
@@ -1,20 +1,30 @@
 ﻿import operator
 import uuid
-from typing import Annotated, Any, Literal, List
+from typing import Annotated, Any, Literal, List, cast
 
 from langchain_core.language_models import BaseChatModel
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
+from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph
 from pydantic import BaseModel, Field
 
 from core.models.places import LandmarksReport, Place, Priority, Landmark
 from core.models.trip import TripRequest
-from core.utils import invoke_react_agent
-from .places_utils import to_json
+from .places_utils import to_json, place_for_llm, invoke_resumable, ainvoke_resumable, search_exhausted, \
+    MAX_SEARCH_RADIUS
 from ..base import BaseAgent
 from ..null_checks import require
 from ..state import SearchInfo
-from ...tools.foursquare import FoursquareApiClient, PlaceSearchRequest, FoursquarePlace, convert_fsq_to_place
+from ...tools.foursquare import FoursquareApiClient, PlaceSearchRequest, FoursquarePlace, convert_fsq_to_place, \
+    is_within_radius, FoursquarePlaceSearchResponse
+
+# Kept static (the destination is part of the user message), so that providers can reuse the cached prompt prefix
+POLISH_INSTRUCTIONS = (
+    "You are an expert travel agent for the given destination. "
+    "Given a list of candidate landmarks for a destination, return a polished, deduplicated, and prioritized "
+    "list of top landmarks. Your response should reference the landmarks by their ID (UUID)."
+)
 
 
 class ImprovedLandmark(BaseModel):
@@ -34,6 +44,12 @@ class LandmarksState(BaseModel):
         description='A list of the currently collected landmarks',
         default_factory=list
     )
+    seen_place_ids: Annotated[set[str], operator.or_] = Field(
+        description='The Foursquare IDs of every place returned so far, so that repeated searches skip them',
+        default_factory=set
+    )
+    search_rounds: int = Field(description='How many search rounds were run so far', default=0)
+    found_in_last_round: int = Field(description='How many new places the last search round found', default=0)
     improved_landmarks: ImprovedLandmarks | None = Field(default=None)
     report: LandmarksReport | None = Field(
         description='The final report',
@@ -41,6 +57,10 @@ class LandmarksState(BaseModel):
     )
     local_info: SearchInfo = Field()
 
+    @property
+    def landmarks_left(self) -> int:
+        return max(0, self.landmarks_to_retrieve - len(self.landmarks))
+
 
 class LandmarkScoutAgent(BaseAgent):
     """
@@ -51,7 +71,9 @@ class LandmarkScoutAgent(BaseAgent):
         super().__init__('landmark_scout')
         self._client = client
         self._llm = llm
-        self.workflow = self._create_workflow().compile()
+        # Polishing only ranks and annotates the given candidates, so it needs no tools (a single LLM call)
+        self._polish_llm = llm.with_structured_output(ImprovedLandmarks)
+        self.workflow = self._create_workflow().compile(checkpointer=MemorySaver())
 
     def _create_workflow(self) -> StateGraph[LandmarksState, Any, LandmarksState]:
         workflow = StateGraph(
@@ -61,8 +83,8 @@ class LandmarkScoutAgent(BaseAgent):
         )
 
         workflow.add_node('expand_search_info', self._expand_search)
-        workflow.add_node('search_landmarks', self._search_landmarks)
-        workflow.add_node('polish_results', self._polish_results)
+        workflow.add_node('search_landmarks', RunnableLambda(self._search_landmarks, afunc=self._asearch_landmarks))
+        workflow.add_node('polish_results', RunnableLambda(self._polish_results, afunc=self._apolish_results))
         workflow.add_node('generate_report', self._generate_report)
 
         workflow.set_entry_point('search_landmarks')
@@ -84,16 +106,25 @@ class LandmarkScoutAgent(BaseAgent):
     def _polish_results(self, state: LandmarksState) -> LandmarksState:
         self._log.info('🏞️ Polishing search results for landmarks')
 
-        candidate_places = [p.model_dump_json() for p in state.landmarks]
-        trip_ctx = require(state.trip_request).model_dump_json()
+        state.improved_landmarks = cast(ImprovedLandmarks, self._polish_llm.invoke(self._polish_messages(state)))
 
-        system = (
-            f"You are an expert travel agent in {state.trip_request.destination}. "
-            "Given a list of candidate landmarks for a destination, return a polished, deduplicated, and prioritized "
-            "list of top landmarks. Your response should reference the landmarks by their ID (UUID)."
-        )
+        return state
+
+    async def _apolish_results(self, state: LandmarksState) -> LandmarksState:
+        self._log.info('🏞️ Polishing search results for landmarks')
+
+        state.improved_landmarks = cast(ImprovedLandmarks, await self._polish_llm.ainvoke(self._polish_messages(state)))
+
+        return state
+
+    @staticmethod
+    def _polish_messages(state: LandmarksState) -> list[BaseMessage]:
+        # Plain dicts, so that the payload is serialized once (and not as JSON strings inside JSON)
+        candidate_places = [place_for_llm(p) for p in state.landmarks]
+        trip_ctx = require(state.trip_request).model_dump(mode='json')
 
         user = {
+            "destination": state.trip_request.destination,
             "user_trip_request": trip_ctx,
             "candidates": candidate_places,
             "instructions": {
@@ -102,15 +133,7 @@ class LandmarkScoutAgent(BaseAgent):
             }
         }
 
-        response = invoke_react_agent(
-            self._llm,
-            messages=[HumanMessage(to_json(user))],
-            schema=ImprovedLandmarks,
-            system_message=SystemMessage(system))
-
-        state.improved_landmarks = response
-
-        return state
+        return [SystemMessage(POLISH_INSTRUCTIONS), HumanMessage(to_json(user))]
 
     def _generate_report(self, state: LandmarksState) -> LandmarksState:
         self._log.info('📃 Generating landmark report...')
@@ -125,24 +148,66 @@ class LandmarkScoutAgent(BaseAgent):
 
         return state
 
-    @staticmethod
-    def _needs_more_landmarks(state: LandmarksState) -> Literal['search_more_landmarks', 'ok']:
-        return 'search_more_landmarks' if len(state.landmarks) < 50 else 'ok'
+    def _needs_more_landmarks(self, state: LandmarksState) -> Literal['search_more_landmarks', 'ok']:
+        # The collected landmarks are already unique (see `seen_place_ids`), so their count can be compared directly
+        if state.landmarks_left == 0:
+            return 'ok'
+
+        if search_exhausted(state.search_rounds, state.found_in_last_round, state.local_info):
+            self._log.info(f'🔎 No more landmarks to find, continuing with {len(state.landmarks)}')
+            return 'ok'
 
-    def _search_landmarks(self, state: LandmarksState) -> dict[str, list[Place]]:
+        return 'search_more_landmarks'
+
+    def _search_landmarks(self, state: LandmarksState) -> dict[str, Any]:
         self._log.info('🔎 Searching for landmarks...')
 
-        req = PlaceSearchRequest(
-            center=require(state.local_info).center,
-            radius=require(state.local_info).radius,
-            limit=state.landmarks_to_retrieve,
-            query='landmarks'
-        )
+        search_requests = self._search_requests(state)
+
+        return self._collect_new_landmarks(state, search_requests, self._client.search_many(search_requests))
+
+    async def _asearch_landmarks(self, state: LandmarksState) -> dict[str, Any]:
+        self._log.info('🔎 Searching for landmarks...')
 
-        fsq_places: list[FoursquarePlace] = require(self._client.search(req)).results
-        places: list[Place] = [convert_fsq_to_place(p) for p in fsq_places]
+        search_requests = self._search_requests(state)
 
-        return {'landmarks': places}
+        return self._collect_new_landmarks(state, search_requests, await self._client.asearch_many(search_requests))
+
+    @staticmethod
+    def _search_requests(state: LandmarksState) -> list[PlaceSearchRequest]:
+        local_info = require(state.local_info)
+
+        # Search the current area and the next wider ones at once, so that the expand-and-retry loop is rarely needed
+        return [
+            PlaceSearchRequest(
+                center=info.center,
+                radius=min(info.radius, MAX_SEARCH_RADIUS),
+                limit=state.landmarks_left,
+                query='landmarks'
+            ) for info in (local_info.expand_radius(i * 10_000) for i in range(3))
+        ]
+
+    @staticmethod
+    def _collect_new_landmarks(
+            state: LandmarksState,
+            search_requests: list[PlaceSearchRequest],
+            responses: list[FoursquarePlaceSearchResponse | None]
+    ) -> dict[str, Any]:
+        unique: dict[str, FoursquarePlace] = {}
+        for request, response in zip(search_requests, responses):
+            for fsq in require(response).results:
+                if fsq.fsq_place_id not in state.seen_place_ids and is_within_radius(fsq, request):
+                    unique.setdefault(fsq.fsq_place_id, fsq)
+
+        new_places = list(unique.values())[:state.landmarks_left]
+        places: list[Place] = [convert_fsq_to_place(p) for p in new_places]
+
+        return {
+            'landmarks': places,
+            'seen_place_ids': {p.fsq_place_id for p in new_places},
+            'search_rounds': state.search_rounds + 1,
+            'found_in_last_round': len(places)
+        }
 
     def _expand_search(self, state: LandmarksState) -> LandmarksState:
         self._log.info('Expanding search...')
@@ -152,13 +217,23 @@ class LandmarkScoutAgent(BaseAgent):
     def invoke(self, request: TripRequest, info: SearchInfo) -> LandmarksReport:
         self._log.info('🔎 Researching landmarks...')
 
-        initial_state = LandmarksState(
+        return self._get_report(invoke_resumable(self.workflow, self._initial_state(request, info), self._log))
+
+    async def ainvoke(self, request: TripRequest, info: SearchInfo) -> LandmarksReport:
+        self._log.info('🔎 Researching landmarks...')
+
+        return self._get_report(await ainvoke_resumable(self.workflow, self._initial_state(request, info), self._log))
+
+    @staticmethod
+    def _initial_state(request: TripRequest, info: SearchInfo) -> LandmarksState:
+        return LandmarksState(
             trip_request=request,
             local_info=info,
             landmarks_to_retrieve=min(50, request.total_days * 6),
         )
 
-        final_state = self.workflow.invoke(input=initial_state)
+    @staticmethod
+    def _get_report(final_state: dict[str, Any]) -> LandmarksReport:
         report = final_state['report']
 
         assert isinstance(report, LandmarksReport)
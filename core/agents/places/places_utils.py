@@ -1,6 +1,100 @@
-﻿from typing import Any
+﻿import json
+import logging
+import uuid
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph.state import CompiledStateGraph
+
+from core.agents.state import SearchInfo
+from core.models.places import Place
+from core.utils import is_transient_error
+
+# Foursquare only accepts a search radius below 100 km
+MAX_SEARCH_RADIUS = 99_999
+
+# Every round already searches several radii at once, so a few rounds cover all that can be found
+MAX_SEARCH_ROUNDS = 4
+
+# How many times a scout workflow is run for one request: the first run and the retries resuming from its checkpoint
+WORKFLOW_ATTEMPTS = 2
 
 
 def to_json(obj: Any) -> str:
-    import json
     return json.dumps(obj, ensure_ascii=False)
+
+
+def search_exhausted(search_rounds: int, found_in_last_round: int, info: SearchInfo) -> bool:
+    """
+    Whether another (wider) search round cannot be expected to find more places: the last round found nothing new
+    (e.g. a sparse area), the radius cannot grow any further or the round limit was reached.
+    """
+    return found_in_last_round == 0 or info.radius >= MAX_SEARCH_RADIUS or search_rounds >= MAX_SEARCH_ROUNDS
+
+
+def place_for_llm(place: Place) -> dict[str, Any]:
+    """
+    The fields of a Foursquare search result that an LLM can use. The rest only hold placeholder defaults until the
+    LLM fills them out, so sending them would only cost tokens.
+    """
+    projected: dict[str, Any] = {'id': str(place.id), 'name': place.name}
+
+    if place.coordinates is not None:
+        projected['coordinates'] = f'{place.coordinates.latitude:.4f},{place.coordinates.longitude:.4f}'
+    if place.website:
+        projected['website'] = place.website
+
+    return projected
+
+
+def invoke_resumable(workflow: CompiledStateGraph, state: Any, log: logging.Logger) -> dict[str, Any]:
+    """
+    Runs a workflow compiled with a `MemorySaver` checkpointer. When a node fails with a transient error (rate limit,
+    timeout, unreachable service), the workflow is resumed from the last completed step instead of starting over, so
+    the work of the nodes before it (e.g. Foursquare searches) is kept. Any other error is raised right away.
+    """
+    with _checkpoint_thread(workflow) as config:
+        for attempt in range(1, WORKFLOW_ATTEMPTS + 1):
+            try:
+                return workflow.invoke(state, config)
+            except Exception as e:
+                _resume_or_raise(e, attempt, log)
+                # Passing no input resumes the interrupted run instead of starting a new one
+                state = None
+
+    raise AssertionError('unreachable')
+
+
+async def ainvoke_resumable(workflow: CompiledStateGraph, state: Any, log: logging.Logger) -> dict[str, Any]:
+    with _checkpoint_thread(workflow) as config:
+        for attempt in range(1, WORKFLOW_ATTEMPTS + 1):
+            try:
+                return await workflow.ainvoke(state, config)
+            except Exception as e:
+                _resume_or_raise(e, attempt, log)
+                # Passing no input resumes the interrupted run instead of starting a new one
+                state = None
+
+    raise AssertionError('unreachable')
+
+
+def _resume_or_raise(e: Exception, attempt: int, log: logging.Logger) -> None:
+    if attempt >= WORKFLOW_ATTEMPTS or not is_transient_error(e):
+        raise e
+
+    log.warning(f'Workflow failed ({e}), resuming from the last checkpoint...')
+
+
+@contextmanager
+def _checkpoint_thread(workflow: CompiledStateGraph) -> Iterator[RunnableConfig]:
+    checkpointer = workflow.checkpointer
+    assert isinstance(checkpointer, MemorySaver)
+
+    # A new thread per run: the states of concurrent (or repeated) runs must never be merged
+    thread_id = str(uuid.uuid4())
+    try:
+        yield {'configurable': {'thread_id': thread_id}}
+    finally:
+        checkpointer.delete_thread(thread_id)
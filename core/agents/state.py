@@ -1,12 +1,14 @@
-﻿from typing import Self
+﻿from pathlib import Path
+from typing import Self
 
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.runnables import Runnable
 from pydantic import BaseModel, Field
 
+from core.agents.cache import DiskResponseCache
 from core.models.geography import Coordinates
 from core.models.trip import TripRequest
-from core.utils import invoke_react_agent
+from core.utils import create_structured_react_agent, run_react_agent, arun_react_agent
 
 
 class SearchInfo(BaseModel):
@@ -20,22 +22,49 @@ class SearchInfo(BaseModel):
         )
 
 
-def determine_search(req: TripRequest, llm: Runnable) -> SearchInfo:
-    min_radius = 7_500
+# The search area of a destination does not change between runs, only with the length of the trip
+search_info_cache = DiskResponseCache(Path.home() / '.travelplanner' / 'search_info', ttl_seconds=30 * 24 * 60 * 60)
 
-    prompt = f"""
-    You are selecting a geographic search circle for downstream place discovery. The destination is "{req.destination}".
+
+def search_info_cache_key(req: TripRequest) -> str:
+    return f'search_info:{req.destination.strip().lower()}:{req.total_days}:v1'
+
+
+MIN_SEARCH_RADIUS = 7_500
+
+SEARCH_INSTRUCTIONS = f"""
+You are selecting a geographic search circle for downstream place discovery.
+
+Task:
+- Choose a center (latitude, longitude) and a radius (meters) that best covers key points of interest for the trip.
+- Prefer centroids near the main tourist/transport hubs of the destination.
+
+Constraints:
+- Radius must be >= {MIN_SEARCH_RADIUS} meters
+- Consider trip duration: shorter trips → tighter radius near dense attractions; longer trips → broader radius.
+"""
+
+
+def create_search_agent(llm: Runnable) -> Runnable:
+    """Compile the agent behind `determine_search` once, for callers that determine the search area repeatedly."""
+    return create_structured_react_agent(llm, SearchInfo, system_message=SystemMessage(SEARCH_INSTRUCTIONS))
+
+
+def determine_search(req: TripRequest, llm: Runnable, agent: Runnable | None = None) -> SearchInfo:
+    """
+    :param agent: An agent from `create_search_agent`. When omitted, a new one is compiled for this call.
+    """
+    return run_react_agent(agent or create_search_agent(llm), [HumanMessage(_search_prompt(req))], SearchInfo)
+
+
+async def adetermine_search(req: TripRequest, llm: Runnable, agent: Runnable | None = None) -> SearchInfo:
+    return await arun_react_agent(agent or create_search_agent(llm), [HumanMessage(_search_prompt(req))], SearchInfo)
+
+
+def _search_prompt(req: TripRequest) -> str:
+    return f"""
+    The destination is "{req.destination}".
     
     Inputs:
     {req.format_for_llm()}
-
-    Task:
-    - Choose a center (latitude, longitude) and a radius (meters) that best covers key points of interest for the trip.
-    - Prefer centroids near the main tourist/transport hubs of the destination.
-    
-    Constraints:
-    - Radius must be >= {min_radius} meters
-    - Consider trip duration: shorter trips → tighter radius near dense attractions; longer trips → broader radius.
     """
-
-    return invoke_react_agent(llm, [HumanMessage(prompt)], schema=SearchInfo)
@@ -7,14 +7,21 @@ from core.agents.places.destination_scout import DestinationScoutAgent
 from core.models.itinerary import TripItinerary
 from core.models.places import DestinationReport
 from core.models.trip import TripRequest
-from core.tools.foursquare import FoursquareApiClient
+from core.tools import geocoding
+from core.tools.foursquare import get_fsq_client
 
 
-def run_agent_workflow(request: TripRequest, llm: BaseChatModel, log: logging.Logger) -> TripItinerary:
-    log.info(f'Received trip request: \n{request.model_dump_json(indent=2)}')
+def run_agent_workflow(
+        request: TripRequest,
+        llm: BaseChatModel,
+        log: logging.Logger,
+        llm_fast: BaseChatModel | None = None
+) -> TripItinerary:
+    if log.isEnabledFor(logging.INFO):
+        log.info(f'Received trip request: \n{request.model_dump_json(indent=2)}')
 
-    scout_agent_workflow = DestinationScoutAgent(llm=llm, client=FoursquareApiClient())
-    itinerary_agent_workflow = ItineraryBuilderAgent(llm=llm)
+    scout_agent_workflow = DestinationScoutAgent(llm=llm, client=get_fsq_client())
+    itinerary_agent_workflow = ItineraryBuilderAgent(llm=llm, llm_fast=llm_fast)
 
     destination_report: DestinationReport = scout_agent_workflow.invoke(request)
     assert isinstance(destination_report, DestinationReport)
@@ -23,3 +30,34 @@ def run_agent_workflow(request: TripRequest, llm: BaseChatModel, log: logging.Lo
     assert isinstance(itinerary, TripItinerary)
 
     return itinerary
+
+
+async def arun_agent_workflow(
+        request: TripRequest,
+        llm: BaseChatModel,
+        log: logging.Logger,
+        llm_fast: BaseChatModel | None = None
+) -> TripItinerary:
+    """
+    Same as `run_agent_workflow`, but the agents await their LLM calls, so the scouts (and the days of the itinerary)
+    overlap their I/O on a single event loop.
+    """
+    if log.isEnabledFor(logging.INFO):
+        log.info(f'Received trip request: \n{request.model_dump_json(indent=2)}')
+
+    client = get_fsq_client()
+    scout_agent_workflow = DestinationScoutAgent(llm=llm, client=client)
+    itinerary_agent_workflow = ItineraryBuilderAgent(llm=llm, llm_fast=llm_fast)
+
+    try:
+        destination_report: DestinationReport = await scout_agent_workflow.ainvoke(request)
+        assert isinstance(destination_report, DestinationReport)
+
+        itinerary: TripItinerary = await itinerary_agent_workflow.ainvoke(request, destination_report)
+        assert isinstance(itinerary, TripItinerary)
+    finally:
+        # The async HTTP clients are bound to this event loop, which `asyncio.run` closes right after we return
+        await client.aclose()
+        await geocoding.aclose()
+
+    return itinerary
@@ -1,7 +1,8 @@
 ﻿import uuid
 from datetime import datetime
 from enum import Enum
-from typing import List, Optional, Dict, Any, Type, cast, TypeVar
+from itertools import chain
+from typing import List, Optional, Dict
 
 from pydantic import BaseModel, Field
 
@@ -135,17 +136,9 @@ class DestinationReport(BaseModel):
 
     @property
     def all_places(self) -> list[Place]:
-        return (
-                cast_items(self.landmarks.report, Place) +
-                cast_items(self.establishments.report, Place) +
-                cast_items(self.events.report, Place) +
-                cast_items(self.accommodations.report, Place)
-        )
-
-
-T = TypeVar('T')
-
-
-def cast_items(items: List[Any], t: Type[T]) -> List[T]:
-    # Only keep instances of t, then cast to satisfy the type checker
-    return [cast(T, x) for x in items if isinstance(x, t)]
+        return list(chain(
+            self.landmarks.report,
+            self.establishments.report,
+            self.events.report,
+            self.accommodations.report
+        ))
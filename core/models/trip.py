@@ -1,8 +1,9 @@
 from datetime import date
 from enum import Enum
+from functools import cached_property
 from typing import List, Self
 
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
 
 class TripType(Enum):
@@ -13,6 +14,9 @@ class TripType(Enum):
 
 
 class TripRequest(BaseModel):
+    # Frozen, so that the derived values below can be computed once and cached
+    model_config = ConfigDict(frozen=True)
+
     destination: str = Field(
         description="The target destination city, country, or region for the trip"
     )
@@ -48,18 +52,26 @@ class TripRequest(BaseModel):
 
         return self
 
-    @property
+    @cached_property
     def total_nights(self) -> int:
         return (self.end_date - self.start_date).days
 
-    @property
+    @cached_property
     def total_days(self) -> int:
         return self.total_nights + 1
 
     def format_interests(self) -> str:
-        return ", ".join(interest.title() for interest in self.interests)
+        return self._formatted_interests
 
     def format_for_llm(self) -> str:
+        return self._formatted_for_llm
+
+    @cached_property
+    def _formatted_interests(self) -> str:
+        return ", ".join(interest.title() for interest in self.interests)
+
+    @cached_property
+    def _formatted_for_llm(self) -> str:
         return f"""
         - Duration: {self.total_days} days ({self.start_date} to {self.end_date})
         - Budget: ${self.budget:,.2f} EUR
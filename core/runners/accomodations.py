@@ -1,12 +1,14 @@
 ﻿from core.agents.places.accommodation_scout import AccommodationScoutAgent
 from core.agents.state import determine_search
-from core.runners.setup import llm, example_request
-from core.tools.foursquare import FoursquareApiClient
+from core.runners.setup import configure_logging, get_llm, example_request
+from core.tools.foursquare import get_fsq_client
 
 if __name__ == '__main__':
-    info = determine_search(example_request, llm)
-    fsq_client = FoursquareApiClient()
-    agent = AccommodationScoutAgent(llm, fsq_client)
+    configure_logging()
+
+    info = determine_search(example_request, get_llm())
+    fsq_client = get_fsq_client()
+    agent = AccommodationScoutAgent(get_llm(), fsq_client)
 
     report = agent.invoke(example_request, info)
 
@@ -1,12 +1,16 @@
-﻿from core.agents.places.destination_scout import DestinationScoutAgent
-from core.runners.setup import example_request, llm
-from core.tools.foursquare import FoursquareApiClient
+﻿import asyncio
+
+from core.agents.places.destination_scout import DestinationScoutAgent
+from core.runners.setup import configure_logging, example_request, get_llm
+from core.tools.foursquare import get_fsq_client
 
 if __name__ == '__main__':
+    configure_logging()
+
     agent = DestinationScoutAgent(
-        llm=llm,
-        client=FoursquareApiClient()
+        llm=get_llm(),
+        client=get_fsq_client()
     )
-    report = agent.invoke(example_request)
+    report = asyncio.run(agent.ainvoke(example_request))
 
     print(report.model_dump_json(indent=2))
@@ -1,9 +1,11 @@
-﻿import datetime
+﻿import asyncio
+import datetime
 
 from core.agents.itinerary.itinerary_agent import ItineraryBuilderAgent
 from core.agents.places.destination_scout import DestinationScoutAgent
-from core.runners.setup import log, llm, example_request
-from core.tools.foursquare import FoursquareApiClient
+from core.models.itinerary import TripItinerary
+from core.runners.setup import configure_logging, log, get_llm, example_request
+from core.tools.foursquare import get_fsq_client
 
 
 def _safe_filename_component(text: str) -> str:
@@ -14,17 +16,23 @@ def _safe_filename_component(text: str) -> str:
     return "".join(ch if ch.isalnum() or ch in ("-", "_") else "_" for ch in text.strip().lower())
 
 
-if __name__ == '__main__':
+async def main() -> TripItinerary:
     scout_agent = DestinationScoutAgent(
-        llm=llm,
-        client=FoursquareApiClient()
+        llm=get_llm(),
+        client=get_fsq_client()
     )
 
-    report = scout_agent.invoke(example_request)
+    report = await scout_agent.ainvoke(example_request)
     log.info('Finished scouting')
-    itinerary_agent = ItineraryBuilderAgent(llm)
+    itinerary_agent = ItineraryBuilderAgent(get_llm())
+
+    return await itinerary_agent.ainvoke(example_request, report)
+
+
+if __name__ == '__main__':
+    configure_logging()
 
-    itinerary = itinerary_agent.invoke(example_request, report)
+    itinerary = asyncio.run(main())
 
     # Build a Windows-safe filename by sanitizing destination and timestamp
     dest_part = _safe_filename_component(example_request.destination)
@@ -1,11 +1,13 @@
 ﻿from core.agents.places.establishment_scout import EstablishmentScoutAgent
 from core.agents.state import determine_search
-from core.runners.setup import llm, example_request
-from core.tools.foursquare import FoursquareApiClient
+from core.runners.setup import configure_logging, get_llm, example_request
+from core.tools.foursquare import get_fsq_client
 
 if __name__ == '__main__':
-    info = determine_search(example_request, llm)
-    agent = EstablishmentScoutAgent(llm, FoursquareApiClient())
+    configure_logging()
+
+    info = determine_search(example_request, get_llm())
+    agent = EstablishmentScoutAgent(get_llm(), get_fsq_client())
     report = agent.invoke(example_request, info)
 
     print(report.model_dump_json(indent=2))
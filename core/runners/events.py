@@ -1,8 +1,10 @@
 ﻿from core.agents.places.event_scout import EventScoutAgent
-from core.runners.setup import llm, example_request
+from core.runners.setup import configure_logging, get_llm, example_request
 
 if __name__ == '__main__':
-    agent = EventScoutAgent(llm)
+    configure_logging()
+
+    agent = EventScoutAgent(get_llm())
     report = agent.invoke(example_request)
 
     print(report.model_dump_json(indent=2))
@@ -1,16 +1,18 @@
-﻿import logging
+﻿import json
+import logging
+from dataclasses import asdict
 
 from dotenv import load_dotenv
 
 from core.models.geography import Coordinates
-from core.tools.foursquare import FoursquareApiClient, PlaceSearchRequest
+from core.tools.foursquare import get_fsq_client, PlaceSearchRequest
 
 if __name__ == '__main__':
     load_dotenv()
     logging.basicConfig(level=logging.DEBUG)
 
-    api = FoursquareApiClient()
+    api = get_fsq_client()
     resp = api.search(PlaceSearchRequest(center=Coordinates(latitude=38.1, longitude=23.9)))
 
     if resp is not None:
-        print(resp.model_dump_json(indent=2))
+        print(json.dumps(asdict(resp), indent=2, ensure_ascii=False))
@@ -1,7 +1,9 @@
 ﻿from core.agents.state import determine_search
-from core.runners.setup import llm, example_request
+from core.runners.setup import configure_logging, get_llm, example_request
 
 if __name__ == '__main__':
-    info = determine_search(example_request, llm)
+    configure_logging()
+
+    info = determine_search(example_request, get_llm())
 
     print(info.model_dump_json(indent=2))
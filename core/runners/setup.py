@@ -1,42 +1,63 @@
 ﻿import logging
 import os
 from datetime import date
+from functools import lru_cache
+from typing import TYPE_CHECKING
 
-import colorlog
-import httpx
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 
 from core.models.trip import TripType, TripRequest
 
-logging.basicConfig(
-    level=logging.INFO,
-    handlers=[colorlog.StreamHandler()],
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-
-log_format = (
-    "%(asctime)s "
-    "[%(log_color)s%(levelname)s%(reset)s] "
-    "%(log_color)s%(name)s%(reset)s: "
-    "%(message)s"
-)
-
-# Update the root logger's handler with a ColoredFormatter
-formatter = colorlog.ColoredFormatter(log_format)
-logging.getLogger().handlers[0].setFormatter(formatter)
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
 
 log = logging.getLogger('main')
 
 load_dotenv()
 
-log.info('Starting')
-llm = ChatOpenAI(
-    model='x-ai/grok-4-fast:free',
-    base_url="https://openrouter.ai/api/v1",
-    timeout=httpx.Timeout(connect=20, read=180, write=180, pool=30),
-    max_retries=2
-)
+
+def configure_logging() -> None:
+    """
+    Sets up colored console logging. Called by the runners on start-up, so that importing this module (e.g. for
+    `example_request`) does not reconfigure the logging of whoever imports it.
+    """
+    import colorlog
+
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[colorlog.StreamHandler()],
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+    log_format = (
+        "%(asctime)s "
+        "[%(log_color)s%(levelname)s%(reset)s] "
+        "%(log_color)s%(name)s%(reset)s: "
+        "%(message)s"
+    )
+
+    # Update the root logger's handler with a ColoredFormatter
+    formatter = colorlog.ColoredFormatter(log_format)
+    logging.getLogger().handlers[0].setFormatter(formatter)
+
+    log.info('Starting')
+
+
+@lru_cache(maxsize=1)
+def get_llm() -> 'ChatOpenAI':
+    """
+    The chat model used by the runners. It is created (and langchain_openai imported) on first use, since importing
+    it takes a noticeable part of the start-up time.
+    """
+    import httpx
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model='x-ai/grok-4-fast:free',
+        base_url="https://openrouter.ai/api/v1",
+        timeout=httpx.Timeout(connect=20, read=180, write=180, pool=30),
+        max_retries=2
+    )
 
 example_request = TripRequest(
     destination='Athens',
@@ -1,20 +1,26 @@
-﻿from langgraph.graph.state import CompiledStateGraph
+﻿from typing import Protocol
 
-import setup as base
+from langgraph.graph.state import CompiledStateGraph
+
+import core.runners.setup as base
 from core.agents.places.accommodation_scout import AccommodationScoutAgent
-from core.tools.foursquare import FoursquareApiClient
+from core.tools.foursquare import get_fsq_client
+
+
+class _HasWorkflow(Protocol):
+    workflow: CompiledStateGraph
 
 
-# noinspection PyUnresolvedReferences
-def display_agent(agent: object) -> None:
-    if not hasattr(agent, 'workflow') and not isinstance(agent.workflow, CompiledStateGraph):
+def display_agent(agent: _HasWorkflow) -> None:
+    if not isinstance(getattr(agent, 'workflow', None), CompiledStateGraph):
         raise ValueError('Agent must have "workflow" field that is a compiled state graph')
 
     with open(f'{agent.__class__.__name__}.png', 'wb') as f:
         f.write(agent.workflow.get_graph().draw_mermaid_png())
 
 
-ag = AccommodationScoutAgent(base.llm, FoursquareApiClient())
-
 if __name__ == '__main__':
-    pass
+    base.configure_logging()
+
+    # Built here rather than at import, so that importing `display_agent` does not compile an agent
+    display_agent(AccommodationScoutAgent(base.get_llm(), get_fsq_client()))
@@ -1,25 +1,48 @@
-﻿import logging
+﻿import asyncio
+import atexit
+import json
+import logging
 import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from pathlib import Path
 from typing import Optional, List, Any
 
-import requests
+import httpx
 from langchain_core.tools import BaseTool, ArgsSchema
 from pydantic import BaseModel, Field
 
+from core.agents.cache import DiskResponseCache, ResponseCache
+from core.agents.null_checks import require
 from core.models.geography import Coordinates
 from core.models.places import PlaceCategory, Place, Priority, BookingType
+from core.tools.retry import is_retryable, backoff_delay
+from core.tools.spherical_distance import haversine_distance
+
+# Rate limits, server errors and timeouts are usually transient, so such requests are sent again after a short backoff
+_SEND_ATTEMPTS = 3
+_RETRY_BASE_DELAY_SECONDS = 0.5
+
+# Search results rarely change within a day, so re-runs for the same destination skip the network
+foursquare_cache = DiskResponseCache(Path.home() / '.travelplanner' / 'foursquare', ttl_seconds=24 * 60 * 60)
 
 foursquare_category_map: dict[PlaceCategory, str] = {
     PlaceCategory.HOTEL: '4bf58dd8d48988d1fa931735'
 }
 
 
-class FoursquarePlace(BaseModel):
-    fsq_place_id: str = Field()
-    name: str = Field()
-    latitude: float | None = Field(default=None)
-    longitude: float | None = Field(default=None)
-    website: str | None = Field(default=None)
+# The response types are internal (never part of an LLM schema), so they are plain dataclasses that skip validation
+@dataclass(slots=True)
+class FoursquarePlace:
+    fsq_place_id: str
+    name: str
+    latitude: float | None = None
+    longitude: float | None = None
+    website: str | None = None
 
 
 class FoursquarePlaceSearchRequest:
@@ -29,8 +52,24 @@ class FoursquarePlaceSearchRequest:
         self.fsq_category_ids = fsq_category_ids
 
 
-class FoursquarePlaceSearchResponse(BaseModel):
-    results: list[FoursquarePlace] = Field()
+@dataclass(slots=True)
+class FoursquarePlaceSearchResponse:
+    results: list[FoursquarePlace]
+
+    @classmethod
+    def from_json(cls, content: dict[str, Any]) -> 'FoursquarePlaceSearchResponse':
+        return cls(results=[
+            FoursquarePlace(
+                fsq_place_id=place['fsq_place_id'],
+                name=place['name'],
+                latitude=place.get('latitude'),
+                longitude=place.get('longitude'),
+                website=place.get('website')
+            ) for place in content['results']
+        ])
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
 
 
 class PlaceSearchRequest(BaseModel):
@@ -68,31 +107,86 @@ class PlaceSearchTool(BaseTool):
 
     def __init__(self, **kwargs: Any):
         super().__init__(**kwargs)
-        self._client = FoursquareApiClient()
+        self._client = get_fsq_client()
         self._log = logging.getLogger('fsq_tool')
 
     def _run(self, request: PlaceSearchRequest) -> List[Place]:
         self._log.info('Invoking FSQ tool')
-        response = self._client.search(request)
+        response = require(self._client.search(request))
+        return [convert_fsq_to_place(fsq_place) for fsq_place in response.results]
+
+    async def _arun(self, request: PlaceSearchRequest) -> List[Place]:
+        self._log.info('Invoking FSQ tool')
+        response = require(await self._client.asearch(request))
         return [convert_fsq_to_place(fsq_place) for fsq_place in response.results]
 
 
+class _AsyncSearchState:
+    """The async client and in-flight searches can only be awaited on the event loop that created them."""
+
+    def __init__(self, http: httpx.AsyncClient):
+        self.http = http
+        self.in_flight: dict[tuple[Any, ...], asyncio.Future[FoursquarePlaceSearchResponse]] = {}
+
+
 class FoursquareApiClient:
     """
     Interfaces with the Foursquare "Places API" to search and retrieve relevant places for a given location.
     """
 
-    def __init__(self):
+    def __init__(self, cache_ttl_seconds: float = 10 * 60, cache: ResponseCache | None = None):
+        """
+        :param cache_ttl_seconds: How long identical search requests are answered from memory
+        :param cache: A persistent cache that is looked up before calling the API. None to always call the API
+        """
         self._log = logging.getLogger(name='fsq')
         self._base_url = 'https://places-api.foursquare.com/places'
         self._bearer_token = os.environ.get('FOURSQUARE_API_KEY')
+        self._cache_ttl_seconds = cache_ttl_seconds
+        self._cache = cache
+        self._responses: dict[tuple[Any, ...], tuple[float, FoursquarePlaceSearchResponse]] = {}
+        self._in_flight: dict[tuple[Any, ...], threading.Event] = {}
+        self._lock = threading.Lock()
+
+        # Pooled clients keep connections alive between searches instead of a new handshake per call
+        self._http_options: dict[str, Any] = dict(
+            base_url=self._base_url,
+            headers={
+                'accept': 'application/json',
+                'X-Places-Api-Version': '2025-06-17',
+                'authorization': f'Bearer {self._bearer_token}'
+            },
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+            timeout=10.0
+        )
+        self._http = httpx.Client(**self._http_options)
+        self._async_states: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _AsyncSearchState] = \
+            weakref.WeakKeyDictionary()
 
         if self._bearer_token is None:
             self._log.warning('Foursquare API bearer token not found. Requests will not be sent.')
 
+    def close(self) -> None:
+        """Closes the pooled connections of the synchronous client."""
+        self._http.close()
+
+    async def aclose(self) -> None:
+        """Closes the pooled connections of the running event loop's client. Await it before the loop is shut down."""
+        state = self._async_states.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state.http.aclose()
+
+    def _async_state(self) -> '_AsyncSearchState':
+        loop = asyncio.get_running_loop()
+        state = self._async_states.get(loop)
+        if state is None:
+            state = self._async_states[loop] = _AsyncSearchState(httpx.AsyncClient(**self._http_options))
+        return state
+
     def search(self, request: PlaceSearchRequest) -> FoursquarePlaceSearchResponse | None:
         """
         Calls the Foursquare "Places API" to retrieve up-to-date and relevant place information based on the given request. 
+        Identical requests (including concurrent ones) share a single API call.
         
         :param request: Configures the API request 
         :return: A strongly typed response that contains basic place information
@@ -100,13 +194,172 @@ class FoursquareApiClient:
         if self._bearer_token is None:
             return None
 
-        fsq = self._adapt_request(request)
+        key = self._cache_key(request)
 
-        headers = {
-            'accept': 'application/json',
-            'X-Places-Api-Version': '2025-06-17',
-            'authorization': f'Bearer {self._bearer_token}'
-        }
+        while True:
+            with self._lock:
+                cached = self._responses.get(key)
+                if cached is not None and cached[0] > time.monotonic():
+                    self._log.info('Using cached Foursquare response')
+                    return cached[1]
+
+                pending = self._in_flight.get(key)
+                is_owner = pending is None
+                if pending is None:
+                    pending = self._in_flight[key] = threading.Event()
+
+            if is_owner:
+                break
+
+            # Another thread is sending the same request, wait for it and look at the cache again (it may have failed)
+            pending.wait()
+
+        try:
+            response = self._send(request)
+
+            self._remember(key, response)
+
+            return response
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            pending.set()
+
+    async def asearch(self, request: PlaceSearchRequest) -> FoursquarePlaceSearchResponse | None:
+        """
+        Same as `search`, but awaits the API call instead of blocking the event loop. Identical requests awaited at the
+        same time share a single API call.
+        """
+        if self._bearer_token is None:
+            return None
+
+        key = self._cache_key(request)
+
+        with self._lock:
+            cached = self._responses.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                self._log.info('Using cached Foursquare response')
+                return cached[1]
+
+        in_flight = self._async_state().in_flight
+        pending = in_flight.get(key)
+        if pending is None:
+            pending = in_flight[key] = asyncio.ensure_future(self._asend(request))
+            pending.add_done_callback(lambda _: in_flight.pop(key, None))
+
+        # Shielded, so that a cancelled caller does not cancel the request for the others waiting on it
+        response = await asyncio.shield(pending)
+
+        self._remember(key, response)
+
+        return response
+
+    def search_many(self, search_requests: List[PlaceSearchRequest]) -> List[FoursquarePlaceSearchResponse | None]:
+        """
+        Sends several searches concurrently. The responses are returned in the same order as the requests. A search
+        that still fails after its retries is logged and answered with no results, so that it does not fail the others.
+        """
+        if len(search_requests) <= 1:
+            return [self._search_or_empty(request) for request in search_requests]
+
+        with ThreadPoolExecutor(max_workers=min(4, len(search_requests))) as executor:
+            return list(executor.map(self._search_or_empty, search_requests))
+
+    async def asearch_many(
+            self,
+            search_requests: List[PlaceSearchRequest]
+    ) -> List[FoursquarePlaceSearchResponse | None]:
+        """Same as `search_many`, but the searches are awaited together."""
+        return list(await asyncio.gather(*[self._asearch_or_empty(request) for request in search_requests]))
+
+    def _search_or_empty(self, request: PlaceSearchRequest) -> FoursquarePlaceSearchResponse | None:
+        try:
+            return self.search(request)
+        except httpx.HTTPError as e:
+            return self._failed_search(request, e)
+
+    async def _asearch_or_empty(self, request: PlaceSearchRequest) -> FoursquarePlaceSearchResponse | None:
+        try:
+            return await self.asearch(request)
+        except httpx.HTTPError as e:
+            return self._failed_search(request, e)
+
+    def _failed_search(self, request: PlaceSearchRequest, e: httpx.HTTPError) -> FoursquarePlaceSearchResponse:
+        self._log.error(f'Foursquare search failed ({e}) for: {self._cache_key(request)}')
+        return FoursquarePlaceSearchResponse(results=[])
+
+    def _send(self, request: PlaceSearchRequest) -> FoursquarePlaceSearchResponse:
+        cached = self._get_persisted(request)
+        if cached is not None:
+            return cached
+
+        params = self._params(request)
+        self._log.info(f'Sending Foursquare request to {self._base_url}/search')
+        self._log.info(f'Query params: {params}')
+
+        for attempt in range(1, _SEND_ATTEMPTS + 1):
+            try:
+                return self._persist(request, self._parse(self._http.get('/search', params=params)))
+            except httpx.HTTPError as e:
+                if attempt == _SEND_ATTEMPTS or not is_retryable(e):
+                    raise
+                time.sleep(self._retry_delay(attempt, e))
+
+        raise RuntimeError('Ran out of attempts')
+
+    async def _asend(self, request: PlaceSearchRequest) -> FoursquarePlaceSearchResponse:
+        cached = self._get_persisted(request)
+        if cached is not None:
+            return cached
+
+        params = self._params(request)
+        self._log.info(f'Sending Foursquare request to {self._base_url}/search')
+        self._log.info(f'Query params: {params}')
+
+        for attempt in range(1, _SEND_ATTEMPTS + 1):
+            try:
+                return self._persist(request, self._parse(await self._async_state().http.get('/search', params=params)))
+            except httpx.HTTPError as e:
+                if attempt == _SEND_ATTEMPTS or not is_retryable(e):
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt, e))
+
+        raise RuntimeError('Ran out of attempts')
+
+    def _retry_delay(self, attempt: int, e: httpx.HTTPError) -> float:
+        delay = backoff_delay(attempt, _RETRY_BASE_DELAY_SECONDS)
+        self._log.warning(f'Foursquare request failed ({e}), retrying in {delay:.2f}s (attempt #{attempt + 1})')
+        return delay
+
+    def _remember(self, key: tuple[Any, ...], response: FoursquarePlaceSearchResponse) -> None:
+        now = time.monotonic()
+
+        with self._lock:
+            # Expired responses are dropped here, so that a long-running process does not keep every search around
+            for expired in [k for k, (expires_at, _) in self._responses.items() if expires_at <= now]:
+                del self._responses[expired]
+
+            self._responses[key] = (now + self._cache_ttl_seconds, response)
+
+    def _get_persisted(self, request: PlaceSearchRequest) -> FoursquarePlaceSearchResponse | None:
+        cached = self._cache.get(repr(self._cache_key(request))) if self._cache is not None else None
+        if cached is None:
+            return None
+
+        self._log.info('Using persisted Foursquare response')
+        return FoursquarePlaceSearchResponse.from_json(json.loads(cached))
+
+    def _persist(
+            self,
+            request: PlaceSearchRequest,
+            response: FoursquarePlaceSearchResponse
+    ) -> FoursquarePlaceSearchResponse:
+        if self._cache is not None:
+            self._cache.set(repr(self._cache_key(request)), response.to_json())
+        return response
+
+    def _params(self, request: PlaceSearchRequest) -> dict[str, Any]:
+        fsq = self._adapt_request(request)
 
         params: dict[str, Any] = {
             'll': fsq.center,
@@ -122,39 +375,81 @@ class FoursquareApiClient:
         if request.query:
             params['query'] = request.query
 
-        url = f'{self._base_url}/search'
-
-        self._log.info(f'Sending Foursquare request to {url}')
-        self._log.info(f'Query params: {params}')
-
-        response = requests.get(url, params=params, headers=headers)
+        return params
 
+    def _parse(self, response: httpx.Response) -> FoursquarePlaceSearchResponse:
         self._log.info('Received response from Foursquare')
 
         response.raise_for_status()
 
-        return FoursquarePlaceSearchResponse.model_validate(response.json())
+        return FoursquarePlaceSearchResponse.from_json(response.json())
+
+    @staticmethod
+    def _cache_key(request: PlaceSearchRequest) -> tuple[Any, ...]:
+        return (
+            request.center.to_string(),
+            request.radius,
+            tuple(sorted(request.place_categories)),
+            request.query,
+            request.limit
+        )
 
     @staticmethod
     def _adapt_request(request: PlaceSearchRequest) -> FoursquarePlaceSearchRequest:
         return FoursquarePlaceSearchRequest(
             center=request.center.to_string(),
             radius=request.radius,
-            fsq_category_ids=','.join([foursquare_category_map[cat] for cat in request.place_categories])
+            fsq_category_ids=_fsq_category_ids(tuple(request.place_categories))
         )
 
 
-def convert_fsq_to_place(fsq: FoursquarePlace):
-    coordinates: Coordinates | None = Coordinates(fsq.latitude,
-                                                  fsq.longitude) if fsq.latitude and fsq.longitude else None
+@lru_cache(maxsize=64)
+def _fsq_category_ids(categories: tuple[PlaceCategory, ...]) -> str:
+    # Only a handful of category combinations are ever searched, so each is mapped and joined once
+    return ','.join([foursquare_category_map[cat] for cat in categories])
+
+
+# The same for every place found through Foursquare, refined later by the scouts
+_PLACE_DEFAULTS: dict[str, Any] = dict(
+    priority=Priority.ESSENTIAL,
+    reason_to_go='',
+    booking_type=BookingType.REQUIRED,
+    typical_hours_of_stay=0.0,
+    weather_dependent=False
+)
+
+
+@lru_cache(maxsize=1)
+def get_fsq_client() -> FoursquareApiClient:
+    """
+    The client shared by every agent and tool, so that they share its connection pool and response caches.
+    """
+    client = FoursquareApiClient(cache=foursquare_cache)
+    atexit.register(client.close)
+    return client
+
 
-    return Place(
+def convert_fsq_to_place(fsq: FoursquarePlace) -> Place:
+    # Coordinates is a dataclass that checks the latitude/longitude ranges, which Foursquare values are not checked for
+    coordinates: Coordinates | None = Coordinates(fsq.latitude, fsq.longitude) \
+        if fsq.latitude is not None and fsq.longitude is not None else None
+
+    # Every field is either a Foursquare value of the documented type (coordinates are checked above) or a constant,
+    # so validation is skipped
+    return Place.model_construct(
         name=fsq.name,
         coordinates=coordinates,
-        priority=Priority.ESSENTIAL,
-        reason_to_go='',
         website=fsq.website,
-        booking_type=BookingType.REQUIRED,
-        typical_hours_of_stay=0,
-        weather_dependent=False
+        **_PLACE_DEFAULTS
     )
+
+
+def is_within_radius(fsq: FoursquarePlace, request: PlaceSearchRequest) -> bool:
+    """
+    Foursquare only uses the radius of a search to bias its results, so places outside of it can still be returned.
+    Places without coordinates are kept, since their location is filled out later.
+    """
+    if fsq.latitude is None or fsq.longitude is None:
+        return True
+
+    return haversine_distance(request.center, Coordinates(fsq.latitude, fsq.longitude)) * 1000 <= request.radius
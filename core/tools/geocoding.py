@@ -1,12 +1,20 @@
-﻿import logging
+﻿import asyncio
+import json
+import logging
 import os
+import threading
+import time
+import weakref
+from pathlib import Path
 from typing import Any, Optional
 
-import requests
+import httpx
 from langchain_core.tools import BaseTool, ArgsSchema
 from pydantic import BaseModel, Field
 
+from core.agents.cache import DiskResponseCache
 from core.models.geography import Coordinates
+from core.tools.retry import is_retryable, backoff_delay
 
 
 class GeocodingImplicitInput(BaseModel):
@@ -45,9 +53,48 @@ class GeocodingError(BaseModel):
 
 _GLOBAL_GEOCODE_STATE: dict[str, Any] = {
     'last_request_time': 0.0,
-    'lock': None,
+    'lock': threading.Lock(),
 }
 
+_GEOCODE_URL = 'https://geocode.maps.co/search'
+
+# Every attempt waits for its own throttle slot, so the backoff only adds to the throttle interval
+_SEND_ATTEMPTS = 3
+_RETRY_BASE_DELAY_SECONDS = 1.0
+
+# Places do not move, so a geocoded address is reused for a month (and skips the throttle)
+geocoding_cache = DiskResponseCache(Path.home() / '.travelplanner' / 'geocoding', ttl_seconds=30 * 24 * 60 * 60)
+
+# Shared by every tool instance, so that connections to the geocoding API are kept alive between requests
+_http = httpx.Client(timeout=10)
+
+
+class _AsyncGeocodingState:
+    """The async client and in-flight lookups can only be awaited on the event loop that created them."""
+
+    def __init__(self):
+        self.http = httpx.AsyncClient(timeout=10)
+        self.in_flight: dict[str, asyncio.Future[Coordinates | GeocodingError]] = {}
+
+
+_async_states: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _AsyncGeocodingState] = \
+    weakref.WeakKeyDictionary()
+
+
+def _async_state() -> _AsyncGeocodingState:
+    loop = asyncio.get_running_loop()
+    state = _async_states.get(loop)
+    if state is None:
+        state = _async_states[loop] = _AsyncGeocodingState()
+    return state
+
+
+async def aclose() -> None:
+    """Closes the async client of the running event loop. Await it before the loop is shut down."""
+    state = _async_states.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state.http.aclose()
+
 
 class GlobalThrottledGeocodingTool(BaseTool):
     """Geocoding tool with class-level throttling."""
@@ -67,71 +114,159 @@ class GlobalThrottledGeocodingTool(BaseTool):
         self._log = logging.getLogger('geocoding_tool')
 
     @staticmethod
-    def _enforce_throttle() -> None:
-        """Global throttling using external state."""
-        import threading
-        import time
-
-        log = logging.getLogger('global_geocoding_tool')
-
-        # Initialize lock if needed
-        if _GLOBAL_GEOCODE_STATE['lock'] is None:
-            _GLOBAL_GEOCODE_STATE['lock'] = threading.Lock()
-
+    def _reserve_request_slot() -> float:
+        """
+        Reserves the next free request slot across all tool instances and returns how long to wait for it (in seconds).
+        """
         with _GLOBAL_GEOCODE_STATE['lock']:
             current_time = time.time()
-            time_since_last = current_time - _GLOBAL_GEOCODE_STATE['last_request_time']
+            slot = max(current_time, _GLOBAL_GEOCODE_STATE['last_request_time'] + 2.0)
+            _GLOBAL_GEOCODE_STATE['last_request_time'] = slot
+
+        wait = slot - current_time
+        if wait > 0:
+            logging.getLogger('global_geocoding_tool').info(f'🌍 Throttling: sleeping {wait:.2f}s')
+
+        return wait
 
-            if time_since_last < 2.0:
-                sleep_time = 2.0 - time_since_last
-                log.info(f'🌍 Throttling: sleeping {sleep_time:.2f}s')
-                time.sleep(sleep_time)
+    def _enforce_throttle(self) -> None:
+        """Global throttling using external state."""
+        time.sleep(self._reserve_request_slot())
 
-            _GLOBAL_GEOCODE_STATE['last_request_time'] = time.time()
+    async def _aenforce_throttle(self) -> None:
+        await asyncio.sleep(self._reserve_request_slot())
 
     def _run(self, parameters: GeocodingImplicitInput | GeocodingExplicitInput) -> Coordinates | GeocodingError:
         """Simple synchronous geocoding with global throttling."""
 
+        cached = self._get_cached(parameters)
+        if cached is not None:
+            return cached
+
         try:
-            self._enforce_throttle()  # This is synchronized across all tool instances
-            self._log.info(f'🌍 Geocoding: {parameters}')
+            return self._to_result(parameters, self._send(parameters))
+        except Exception as e:
+            self._log.error(f'Geocoding failed: {e}')
+            return GeocodingError(description=str(e), what_to_do='Try again')
+
+    async def _arun(self, parameters: GeocodingImplicitInput | GeocodingExplicitInput) -> Coordinates | GeocodingError:
+        """Same as `_run`, but waits for the throttle and the response without blocking the event loop."""
+
+        cached = self._get_cached(parameters)
+        if cached is not None:
+            return cached
+
+        # Identical lookups awaited at the same time (e.g. by parallel scouts) share a single request
+        key = self._cache_key(parameters)
+        in_flight = _async_state().in_flight
+        pending = in_flight.get(key)
+        if pending is None:
+            pending = in_flight[key] = asyncio.ensure_future(self._ageocode(parameters))
+            pending.add_done_callback(lambda _: in_flight.pop(key, None))
 
-            # Build request
-            url = 'https://geocode.maps.co/search'
-            if hasattr(parameters, 'street'):
-                params = {
-                    'street': parameters.street,
-                    'city': parameters.city,
-                    'country': parameters.country,
-                    'api_key': self._api_key
-                }
-            else:
-                params = {
-                    'q': parameters.query,
-                    'api_key': self._api_key
-                }
-
-            # Make request
-            response = requests.get(url, params=params, timeout=10)
-            self._log.info(f'🌍 Response: HTTP {response.status_code}')
-
-            # Handle response (same error handling as before)
-            if response.status_code == 429:
-                return GeocodingError(description="Rate limited", what_to_do='Try again')
-
-            response.raise_for_status()
-            content = response.json()
-
-            if isinstance(content, list) and content:
-                self._log.info(f'🌍 {len(content)} results for {parameters}')
-                return Coordinates(latitude=content[0]['lat'], longitude=content[0]['lon'])
-            elif isinstance(content, dict):
-                self._log.info(f'🌍 1 result for {parameters}')
-                return Coordinates(latitude=content['lat'], longitude=content['lon'])
-            else:
-                self._log.info(f'🌍 No result for {parameters}')
-                return GeocodingError(description='Location not found', what_to_do='Try different search terms')
+        return await asyncio.shield(pending)
 
+    async def _ageocode(
+            self,
+            parameters: GeocodingImplicitInput | GeocodingExplicitInput
+    ) -> Coordinates | GeocodingError:
+        try:
+            return self._to_result(parameters, await self._asend(parameters))
         except Exception as e:
             self._log.error(f'Geocoding failed: {e}')
             return GeocodingError(description=str(e), what_to_do='Try again')
+
+    def _send(self, parameters: GeocodingImplicitInput | GeocodingExplicitInput) -> httpx.Response:
+        for attempt in range(1, _SEND_ATTEMPTS + 1):
+            self._enforce_throttle()  # This is synchronized across all tool instances
+            self._log.info(f'🌍 Geocoding: {parameters}')
+
+            try:
+                return self._checked(_http.get(_GEOCODE_URL, params=self._params(parameters)))
+            except httpx.HTTPError as e:
+                if attempt == _SEND_ATTEMPTS or not is_retryable(e):
+                    raise
+                time.sleep(self._retry_delay(attempt, e))
+
+        raise RuntimeError('Ran out of attempts')
+
+    async def _asend(self, parameters: GeocodingImplicitInput | GeocodingExplicitInput) -> httpx.Response:
+        for attempt in range(1, _SEND_ATTEMPTS + 1):
+            await self._aenforce_throttle()
+            self._log.info(f'🌍 Geocoding: {parameters}')
+
+            try:
+                return self._checked(await _async_state().http.get(_GEOCODE_URL, params=self._params(parameters)))
+            except httpx.HTTPError as e:
+                if attempt == _SEND_ATTEMPTS or not is_retryable(e):
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt, e))
+
+        raise RuntimeError('Ran out of attempts')
+
+    def _checked(self, response: httpx.Response) -> httpx.Response:
+        self._log.info(f'🌍 Response: HTTP {response.status_code}')
+        response.raise_for_status()
+        return response
+
+    def _retry_delay(self, attempt: int, e: httpx.HTTPError) -> float:
+        delay = backoff_delay(attempt, _RETRY_BASE_DELAY_SECONDS)
+        self._log.warning(f'Geocoding request failed ({e}), retrying in {delay:.2f}s (attempt #{attempt + 1})')
+        return delay
+
+    def _params(self, parameters: GeocodingImplicitInput | GeocodingExplicitInput) -> dict[str, Any]:
+        if isinstance(parameters, GeocodingExplicitInput):
+            params = {
+                'city': parameters.city,
+                'country': parameters.country,
+                'api_key': self._api_key
+            }
+            # Unlike `requests`, httpx sends None values as empty parameters
+            if parameters.street is not None:
+                params['street'] = parameters.street
+            return params
+
+        return {
+            'q': parameters.query,
+            'api_key': self._api_key
+        }
+
+    def _to_result(
+            self,
+            parameters: GeocodingImplicitInput | GeocodingExplicitInput,
+            response: httpx.Response
+    ) -> Coordinates | GeocodingError:
+        content = response.json()
+
+        if isinstance(content, list) and content:
+            self._log.info(f'🌍 {len(content)} results for {parameters}')
+            return self._store_in_cache(parameters, Coordinates(latitude=content[0]['lat'], longitude=content[0]['lon']))
+        elif isinstance(content, dict):
+            self._log.info(f'🌍 1 result for {parameters}')
+            return self._store_in_cache(parameters, Coordinates(latitude=content['lat'], longitude=content['lon']))
+        else:
+            self._log.info(f'🌍 No result for {parameters}')
+            return GeocodingError(description='Location not found', what_to_do='Try different search terms')
+
+    def _get_cached(self, parameters: GeocodingImplicitInput | GeocodingExplicitInput) -> Coordinates | None:
+        cached = geocoding_cache.get(self._cache_key(parameters))
+        if cached is None:
+            return None
+
+        self._log.info(f'🌍 Using cached coordinates for {parameters}')
+        return Coordinates(**json.loads(cached))
+
+    def _store_in_cache(
+            self,
+            parameters: GeocodingImplicitInput | GeocodingExplicitInput,
+            coordinates: Coordinates
+    ) -> Coordinates:
+        geocoding_cache.set(
+            self._cache_key(parameters),
+            json.dumps({'latitude': coordinates.latitude, 'longitude': coordinates.longitude}))
+        return coordinates
+
+    @staticmethod
+    def _cache_key(parameters: GeocodingImplicitInput | GeocodingExplicitInput) -> str:
+        # Lowercased, so that the same address written with different casing shares an entry
+        return 'geocode:' + parameters.model_dump_json().lower()
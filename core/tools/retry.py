@@ -0,0 +1,15 @@
+﻿import random
+
+import httpx
+
+
+def is_retryable(e: httpx.HTTPError) -> bool:
+    """Whether a failed HTTP request is worth sending again: rate limits, server errors, timeouts, lost connections."""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return isinstance(e, httpx.TransportError)
+
+
+def backoff_delay(attempt: int, base_delay_seconds: float) -> float:
+    # Exponential backoff with jitter, so that concurrent requests that failed together do not retry together
+    return base_delay_seconds * 2 ** (attempt - 1) * (1 + random.random())
@@ -1,6 +1,6 @@
 ﻿import logging
 import math
-from typing import Optional, Any
+from typing import Optional, Any, Callable
 
 from langchain_core.tools import BaseTool, ArgsSchema
 from pydantic import BaseModel, Field
@@ -27,25 +27,29 @@ class DistanceTool(BaseTool):
         return haversine_distance(x1, x2)
 
 
-def haversine_distance(x1: Coordinates, x2: Coordinates) -> float:
+def haversine_distance(
+        x1: Coordinates,
+        x2: Coordinates,
+        _r: float = 6371.2,  # Earth's radius (km)
+        _rad: Callable[[float], float] = math.radians,
+        _sin: Callable[[float], float] = math.sin,
+        _cos: Callable[[float], float] = math.cos,
+        _asin: Callable[[float], float] = math.asin,
+        _sqrt: Callable[[float], float] = math.sqrt
+) -> float:
     """
     Calculates the distance between two places on Earth using the Haversine formula.
     Returns distance in kilometers.
     """
-    r = 6371.2  # Earth's radius (km)
+    # The math functions are bound as defaults, since they are faster to look up as locals than as module attributes
+    f1 = _rad(x1.latitude)
+    f2 = _rad(x2.latitude)
 
-    f1, l1 = math.radians(x1.latitude), math.radians(x1.longitude)
-    f2, l2 = math.radians(x2.latitude), math.radians(x2.longitude)
+    s1 = _sin((f2 - f1) * 0.5)
+    s2 = _sin(_rad(x2.longitude - x1.longitude) * 0.5)
 
-    df = f2 - f1
-    dl = l2 - l1
-
-    theta = hav(df) + math.cos(f1) * math.cos(f2) * hav(dl)
-    return 2 * r * math.asin(math.sqrt(theta))
-
-
-def hav(theta: float) -> float:
-    return (1 - math.cos(theta)) / 2
+    theta = s1 * s1 + _cos(f1) * _cos(f2) * s2 * s2
+    return 2 * _r * _asin(_sqrt(theta))
 
 
 if __name__ == '__main__':
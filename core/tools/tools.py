@@ -1,4 +1,6 @@
-﻿from langchain_core.tools import BaseTool
+﻿from functools import lru_cache
+
+from langchain_core.tools import BaseTool
 from langchain_tavily import TavilySearch
 
 from core.tools.geocoding import GlobalThrottledGeocodingTool
@@ -7,9 +9,12 @@ from core.tools.spherical_distance import DistanceTool
 geo_tool = GlobalThrottledGeocodingTool()
 
 
-def get_available_tools() -> list[BaseTool]:
-    return [
+@lru_cache(maxsize=1)
+def get_available_tools() -> tuple[BaseTool, ...]:
+    # The tools hold no per-call state, so every agent shares the same instances. A tuple keeps the shared set
+    # immutable, copy it with list(...) if a mutable list is needed.
+    return (
         TavilySearch(max_results=10),
         DistanceTool(),
         geo_tool,
-    ]
+    )
@@ -1,42 +1,99 @@
 ﻿import logging
-from typing import TypeVar, Any, Type, cast, List, Optional
+from collections import defaultdict
+from typing import TypeVar, Any, Type, List, Optional, Iterable, Sequence
 from uuid import UUID
 
+import httpx
 from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_core.runnables import Runnable
+from langchain_core.runnables import Runnable, RunnableConfig
 from langchain_core.tools import BaseTool
 from langgraph.prebuilt import create_react_agent
 from pydantic import BaseModel
 from tenacity import RetryCallState
 
+from core.agents.cache import ResponseCache, response_cache_key
+from core.tools.retry import is_retryable
 from core.tools.tools import get_available_tools
 
 log = logging.getLogger('app')
 T = TypeVar('T')
 
 
+def is_transient_error(e: BaseException) -> bool:
+    """
+    Whether an error is likely to go away on its own (rate limits, timeouts, server errors, dropped connections) and
+    is therefore worth retrying or tolerating. Any other error points at a bug or bad input and should propagate.
+    """
+    if isinstance(e, httpx.HTTPError):
+        return is_retryable(e)
+
+    # LLM client errors carry the HTTP status code, or are raised from the httpx error that caused them
+    status_code = getattr(e, 'status_code', None)
+    if isinstance(status_code, int):
+        return status_code == 429 or status_code >= 500
+    return isinstance(e, TimeoutError) or isinstance(e.__cause__, httpx.TransportError)
+
+
 def items_of_type(items: List[Any], t: Type[T]) -> List[T]:
-    return [x for x in items if isinstance(x, t)]
+    return list(filter(t.__instancecheck__, items))
+
 
+def bucket_by_type(items: Iterable[Any]) -> dict[type, List[Any]]:
+    """Group items by their concrete type in a single pass."""
+    buckets: dict[type, List[Any]] = defaultdict(list)
+    for x in items:
+        buckets[type(x)].append(x)
+    return buckets
 
-def cast_items(items: List[Any], t: Type[T]) -> List[T]:
-    # Only keep instances of t, then cast to satisfy the type checker
-    return [cast(T, x) for x in items if isinstance(x, t)]
+
+# Kept for existing callers: filtering by type already narrows the item type
+cast_items = items_of_type
 
 
 TOutput = TypeVar('TOutput', bound=BaseModel)
 
+# The agent is retried when the LLM refuses to respond without saying why
+REACT_AGENT_ATTEMPTS = 3
+
 
 def invoke_react_agent(
         llm: Runnable,
         messages: List[HumanMessage],
         schema: Type[TOutput],
         system_message: SystemMessage | None = None,
-        tools: List[BaseTool] | None = None,
+        tools: Sequence[BaseTool] | None = None,
 ) -> TOutput:
     """Invoke a ReAct agent and return a structured response."""
 
+    return run_react_agent(create_structured_react_agent(llm, schema, system_message, tools), messages, schema)
+
+
+async def ainvoke_react_agent(
+        llm: Runnable,
+        messages: List[HumanMessage],
+        schema: Type[TOutput],
+        system_message: SystemMessage | None = None,
+        tools: Sequence[BaseTool] | None = None,
+) -> TOutput:
+    """Same as `invoke_react_agent`, but awaits the agent instead of blocking."""
+
+    return await arun_react_agent(create_structured_react_agent(llm, schema, system_message, tools), messages, schema)
+
+
+def create_structured_react_agent(
+        llm: Runnable,
+        schema: Type[TOutput],
+        system_message: SystemMessage | None = None,
+        tools: Sequence[BaseTool] | None = None
+) -> Runnable:
+    """
+    Compile a ReAct agent that responds with `schema`. Agents whose system message does not change can be compiled
+    once and reused with `run_react_agent`/`arun_react_agent`.
+
+    Keep trip specific data out of `system_message` and send it in the messages instead: a static system prompt
+    comes first in every request, so providers can reuse their cached prompt prefix.
+    """
     static_prompt = f"""
                     {system_message.content if system_message else ''}
                     
@@ -45,47 +102,111 @@ def invoke_react_agent(
                     getting the coordinates for a place, then resort to searching the web for the coordinates
                     """
 
-    agent = create_react_agent(
+    return create_react_agent(
         model=llm,
         tools=tools if tools is not None else get_available_tools(),
         response_format=schema,
         prompt=static_prompt
     )
 
-    handler = LoggingHandler()
-    attempts = 1
 
-    while attempts <= 3:
+def run_react_agent(
+        agent: Runnable,
+        messages: List[HumanMessage],
+        schema: Type[TOutput],
+        cache: ResponseCache | None = None
+) -> TOutput:
+    """
+    Run a compiled ReAct agent and return its structured response.
+    :param cache: Optional store for responses to identical messages. Use a separate cache for every agent, since
+    the key does not include the agent's system prompt or tools.
+    """
+    key = response_cache_key(schema, messages) if cache is not None else ''
+    if (cached := _get_cached_response(cache, key, schema)) is not None:
+        return cached
+
+    config = _react_agent_config()
+
+    for _ in range(REACT_AGENT_ATTEMPTS):
         try:
             # noinspection PyTypeChecker
-            response: dict[str, Any] = agent.invoke(
-                input={'messages': messages},
-                config={
-                    "callbacks": [handler],
-                    "recursion_limit": 100
-                })
+            response: dict[str, Any] = agent.invoke(input={'messages': messages}, config=config)
+            return _store_response(cache, key, _get_structured_response(response, schema))
+        except ValueError as e:
+            _retry_or_raise(e)
 
-            structured_response: TOutput | None = response.get("structured_response")
+    raise RuntimeError('Ran out of attempts')
 
-            if structured_response is None:
-                log.error("Agent did not return a structured response.")
-                raise ValueError(f"Agent did not return a structured response. Dictionary had keys: {response.keys()}")
 
-            return structured_response
-        except ValueError as e:
-            message = str(e)
-            log.error(f'❌ ReAct agent error: {message}')
-            attempts += 1
+async def arun_react_agent(
+        agent: Runnable,
+        messages: List[HumanMessage],
+        schema: Type[TOutput],
+        cache: ResponseCache | None = None
+) -> TOutput:
+    """Same as `run_react_agent`, but awaits the agent instead of blocking."""
+    key = response_cache_key(schema, messages) if cache is not None else ''
+    if (cached := _get_cached_response(cache, key, schema)) is not None:
+        return cached
 
-            if "does not have a 'parsed' field nor a 'refusal' field" in message:
-                log.error('❌ LLM refused to fulfill our request but did not specify why. Retrying the request')
-                continue
+    config = _react_agent_config()
 
-            raise e
+    for _ in range(REACT_AGENT_ATTEMPTS):
+        try:
+            # noinspection PyTypeChecker
+            response: dict[str, Any] = await agent.ainvoke(input={'messages': messages}, config=config)
+            return _store_response(cache, key, _get_structured_response(response, schema))
+        except ValueError as e:
+            _retry_or_raise(e)
 
     raise RuntimeError('Ran out of attempts')
 
 
+def _react_agent_config() -> RunnableConfig:
+    return {"callbacks": [LoggingHandler()], "recursion_limit": 100}
+
+
+def _get_cached_response(cache: ResponseCache | None, key: str, schema: Type[TOutput]) -> TOutput | None:
+    if cache is None or (cached := cache.get(key)) is None:
+        return None
+
+    log.info(f'⚡ Cache hit for {schema.__name__}')
+    return schema.model_validate_json(cached)
+
+
+def _store_response(cache: ResponseCache | None, key: str, response: TOutput) -> TOutput:
+    if cache is not None:
+        cache.set(key, response.model_dump_json())
+
+    return response
+
+
+def _retry_or_raise(e: ValueError) -> None:
+    if not _is_retryable(e):
+        raise e
+
+
+def _get_structured_response(response: dict[str, Any], schema: Type[TOutput]) -> TOutput:
+    structured_response: TOutput | None = response.get("structured_response")
+
+    if structured_response is None:
+        log.error("Agent did not return a structured response.")
+        raise ValueError(f"Agent did not return a structured response. Dictionary had keys: {response.keys()}")
+
+    return structured_response
+
+
+def _is_retryable(e: ValueError) -> bool:
+    message = str(e)
+    log.error(f'❌ ReAct agent error: {message}')
+
+    if "does not have a 'parsed' field nor a 'refusal' field" in message:
+        log.error('❌ LLM refused to fulfill our request but did not specify why. Retrying the request')
+        return True
+
+    return False
+
+
 class LoggingHandler(BaseCallbackHandler):
     def on_tool_start(self, serialized, input_str, run_id, **kwargs):
         log.info(f"Tool '{run_id}' started: {serialized.get('name')}({input_str})")
@@ -1,11 +1,13 @@
-﻿from time import sleep
+﻿import asyncio
+from time import sleep
 
 import core.runners.setup as base
 import user_prompts as prompts
-from core.agents.workflow import run_agent_workflow
+from core.agents.workflow import arun_agent_workflow
 from core.runners.setup import example_request
 
 if __name__ == '__main__':
+    base.configure_logging()
     base.ensure_api_keys_exist()
 
     print("👋 Welcome!")
@@ -14,7 +16,7 @@ if __name__ == '__main__':
 
     print(f'🤖 Creating your itinerary for {request.destination}, this will take a while...')
 
-    itinerary = run_agent_workflow(request, base.llm, base.log)
+    itinerary = asyncio.run(arun_agent_workflow(request, base.get_llm(), base.log))
 
     sleep(0.3)
 